@@ -1,6 +1,9 @@
 from pybloom.src.bloomfilter import BloomFilter
+from pybloom.src.countminsketch import CountMinSketch
+from pybloom.src.migration import migrate
+from pybloom.src.pool import FilterPool
 
 name = 'BloomFilterPy'
 __version__ = '1.1'
 
-__all__ = ['BloomFilter']
+__all__ = ['BloomFilter', 'CountMinSketch', 'FilterPool', 'migrate']
@@ -1,20 +1,88 @@
+import asyncio
+import json
 import math
-import mmh3
 import threading
 from abc import ABCMeta, abstractmethod
+from collections import deque
+from itertools import islice
 
 import numpy as np
 
+from pybloom.src import BloomFilterException
+from pybloom.src.delta import check_delta, decode_delta, encode_delta
+from pybloom.src.hashing import get_hash_engine
 
-class BaseBackend(set):
+DEDUPE_CHUNK_SIZE = 1024
+DUMP_CHUNK_SIZE = 2 ** 16  # bytes
+DIRTY_UNIQUE_SIZE = 64  # bit indexes
+
+
+def chunked(iterable, chunk_size):
+    """
+    Splits an iterable into lists of at most `chunk_size` elements, keeping the original order.\n
+    :param iterable: Iterable to split.
+    :param chunk_size: Max number of elements per chunk.
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def new_rows_mask(indexes, old_bits):
+    """
+    Computes which rows of an (n, k) matrix of indexes would be new if they were inserted one after another, i.e.
+    which rows have at least one bit unset in the filter and not set by any previous row of the same matrix.\n
+    :param indexes: (n, k) matrix of bit indexes.
+    :param old_bits: (n, k) matrix with the current value of every bit in `indexes`.
+    """
+    _, first, inverse = np.unique(indexes.ravel(), return_index=True, return_inverse=True)
+    first_row = (first // indexes.shape[1])[inverse].reshape(indexes.shape)
+    already_set = old_bits.astype(bool) | (first_row < np.arange(indexes.shape[0])[:, None])
+    return ~already_set.all(axis=1)
+
+
+class Hashing(object):
+    """
+    Maps values into `_optimal_hash` indexes in range [0, `_array_size`) using the `_hash_engine` of the instance.
+    """
+
+    @property
+    def hash_engine(self):
+        return self._hash_engine.name
+
+    def _filter_it(self, other, size=None):
+        """
+        Performs hashing operation for bloom filter.\n
+        :param other: Value to filter.
+        :param size: Size the hashes are reduced to. Default is the size of the filter.
+        """
+        return self._hash_engine.indexes(other, self._optimal_hash, size or self._array_size)
+
+    def _filter_many(self, items, size=None):
+        """
+        Performs hashing operation for a batch of values.\n
+        :param items: List of values to filter.
+        :param size: Size the hashes are reduced to. Default is the size of the filter.
+        :return: (n, k) matrix with the bit indexes of every value.
+        """
+        a = self._hash_engine.digest_many(items, self._optimal_hash) % np.uint64(size or self._array_size)
+        return a.astype(np.int64)
+
+
+class BaseBackend(Hashing, set):
     __metaclass__ = ABCMeta
 
-    def __init__(self, array_bits_size: int, optimal_hash: int, filter_size: int, capacity=0):
+    def __init__(self, array_bits_size: int, optimal_hash: int, filter_size: int, capacity=0,
+                 hash_engine='murmur3'):
         super(BaseBackend, self).__init__()
         self._array_size = array_bits_size  # number of bits of filter
         self._filter_size = filter_size  # capacity of filter (less than bit size)
         self._optimal_hash = optimal_hash
         self._capacity = capacity
+        self._hash_engine = get_hash_engine(hash_engine)
 
     @property
     def full(self):
@@ -33,9 +101,65 @@ class BaseBackend(set):
     def reset(self):
         raise NotImplementedError('Not implemented yet!')
 
+    @abstractmethod
+    def _test_and_set(self, other):
+        """
+        Adds a value to the filter hashing it once and reading the old bits while the new ones are written.\n
+        :param other: Value to add.
+        :return: True if the value was not in the filter before.
+        """
+        raise NotImplementedError('Not implemented yet!')
+
+    @abstractmethod
+    def _test_and_set_indexes(self, indexes):
+        """
+        Adds a batch of already hashed values to the filter in a single operation.\n
+        :param indexes: (n, k) matrix with the bit indexes of every value, as returned by `_filter_many`.
+        :return: Boolean numpy array, True for every value that was not in the filter before.
+        """
+        raise NotImplementedError('Not implemented yet!')
+
+    def _test_and_set_many(self, items):
+        return self._test_and_set_indexes(self._filter_many(items))
+
     def add(self, *args, **kwargs):
         return self._add(*args, **kwargs)
 
+    def test_and_set(self, item):
+        return self._test_and_set(item)
+
+    def test_and_set_many(self, items):
+        return self._test_and_set_many(list(items))
+
+    def contains_many(self, items):
+        """
+        Checks a batch of values.\n
+        :param items: Values to check.
+        :return: Boolean numpy array, True for every value that is in the filter.
+        """
+        return np.array([item in self for item in items], dtype=bool)
+
+    def dedupe(self, iterable, chunk_size=DEDUPE_CHUNK_SIZE):
+        """
+        Adds every value of `iterable` to the filter and yields, in order, only those values that were not in the
+        filter yet. Values are read in chunks of `chunk_size` elements and each chunk is tested and set at once.\n
+        :param iterable: Values to deduplicate.
+        :param chunk_size: Number of values tested and set per backend operation.
+        """
+        for chunk in chunked(iterable, chunk_size):
+            for item, new in zip(chunk, self._test_and_set_many(chunk)):
+                if new:
+                    yield item
+
+    def adedupe(self, iterable, chunk_size=DEDUPE_CHUNK_SIZE):
+        """
+        Asynchronous counterpart of `dedupe`. `iterable` can be either an async iterable or a regular one, and
+        every chunk is tested and set in the default executor of the running loop.\n
+        :param iterable: Values to deduplicate.
+        :param chunk_size: Number of values tested and set per backend operation.
+        """
+        return AsyncDedupe(self, iterable, chunk_size)
+
     def __add__(self, other):
         return self.add(other)
 
@@ -45,16 +169,55 @@ class BaseBackend(set):
     def __len__(self):
         return self._capacity
 
-    def _filter_it(self, other):
+    def _check_room(self, added):
+        if self._capacity + added > self._filter_size:
+            raise BloomFilterException('Filter is full')
+
+    def _merge_capacity(self, capacity):
         """
-        Performs hashing operation for bloom filter.\n
-        :param other: Value to filter.
+        Raises the capacity of the filter to the capacity of another filter whose bits have been merged into it.
         """
-        if not isinstance(other, (bytes, str)):
-            other = str(other)
+        self._capacity = max(self._capacity, capacity)
+
+
+class AsyncDedupe(object):
+    """
+    Async iterator returned by `BaseBackend.adedupe`.
+    """
+
+    def __init__(self, backend: BaseBackend, iterable, chunk_size: int):
+        self._backend = backend
+        self._chunk_size = chunk_size
+        self._pending = deque()
+        if hasattr(iterable, '__aiter__'):
+            self._aiterator, self._iterator = iterable.__aiter__(), None
+        else:
+            self._aiterator, self._iterator = None, iter(iterable)
 
-        a = np.array([mmh3.hash(other, i, signed=False) % self._array_size for i in range(self._optimal_hash)])
-        return a
+    def __aiter__(self):
+        return self
+
+    async def _read_chunk(self):
+        if self._iterator is not None:
+            return list(islice(self._iterator, self._chunk_size))
+
+        chunk = []
+        while len(chunk) < self._chunk_size:
+            try:
+                chunk.append(await self._aiterator.__anext__())
+            except StopAsyncIteration:
+                break
+        return chunk
+
+    async def __anext__(self):
+        while not self._pending:
+            chunk = await self._read_chunk()
+            if not chunk:
+                raise StopAsyncIteration
+
+            mask = await asyncio.get_event_loop().run_in_executor(None, self._backend._test_and_set_many, chunk)
+            self._pending.extend(item for item, new in zip(chunk, mask) if new)
+        return self._pending.popleft()
 
 
 class SharedBackend(BaseBackend):
@@ -67,18 +230,208 @@ class SharedBackend(BaseBackend):
         super(SharedBackend, self).__init__(*args, **kwargs)
 
 
+class BackendLock(object):
+    """
+    Reentrant lock of a `ThreadingBackend`. Once the backend is detached, acquiring the lock raises
+    BloomFilterException, so writes to an instance whose bits now live somewhere else are not silently lost.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.detached = None  # error message
+
+    def __enter__(self):
+        self._lock.acquire()
+        if self.detached is not None:
+            self._lock.release()
+            raise BloomFilterException(self.detached)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._lock.release()
+
+    @property
+    def reading(self):
+        """
+        Lock for lookups that must not run during a write, even once the backend is detached.
+        """
+        return self._lock
+
+
 class ThreadingBackend(BaseBackend):
     """
     Backend intended for local bloomfilters using threads. One instance of this backend can be safely shared across
     threads.
     """
+    DELTA_PAGE_SIZE = 2 ** 12  # bytes
 
     def __init__(self, *args, **kwargs):
         super(ThreadingBackend, self).__init__(*args, **kwargs)
 
-        self._lock = threading.RLock()
+        self._lock = BackendLock()
+        self._epoch = 0
+        self._dirty = {}  # page -> epoch of its last write
         self.reset()  # init backend
 
     @property
     def lock(self):
         return self._lock
+
+    def detach(self, message: str):
+        """
+        Makes every later operation that takes the lock of the filter, i.e. every write, raise BloomFilterException.
+        Lookups keep working over the bits the filter had when it was detached.\n
+        :param message: Message of the exception.
+        """
+        with self.lock:
+            self._lock.detached = message
+
+    @property
+    def resident_size(self):
+        """
+        Number of bytes used by the bits of the filter.
+        """
+        raise NotImplementedError('Not implemented yet!')
+
+    @property
+    def epoch(self):
+        return self._epoch
+
+    def _mark_dirty(self, indexes):
+        """
+        Tags the pages of the given bits as written in the current epoch. Must be called holding the lock.\n
+        :param indexes: Numpy array of bit indexes.
+        """
+        page_bits = self.DELTA_PAGE_SIZE * 8
+        if np.size(indexes) > DIRTY_UNIQUE_SIZE:
+            # Batches write the same pages many times, so numpy deduplicates them first
+            pages = np.unique(np.asarray(indexes, dtype=np.int64) // page_bits).tolist()
+        else:
+            # Single values only write `hash_size` bits, and any numpy call costs more than a plain Python loop
+            pages = [idx // page_bits for idx in np.asarray(indexes).ravel().tolist()]
+
+        epoch = self._epoch
+        for page in pages:
+            self._dirty[page] = epoch
+
+    def export_delta(self, since=0):
+        """
+        Exports the pages written since an epoch. Deltas only carry set bits, so `reset` is not exported.\n
+        :param since: Epoch returned by a previous call (0 exports every page written since the filter was created).
+        :return: Tuple (delta bytes, epoch to use as `since` in the next call).
+        """
+        page_bits = self.DELTA_PAGE_SIZE * 8
+        metadata = dict(array_size=self._array_size, hash_size=self._optimal_hash, hash_engine=self.hash_engine,
+                        capacity=self._capacity)
+        with self.lock:
+            pages = {page: self._read_bits(page * page_bits, min((page + 1) * page_bits, self._array_size))
+                     for page, epoch in self._dirty.items() if epoch >= since}
+            self._epoch += 1
+            next_since = self._epoch
+
+        return encode_delta(metadata, self.DELTA_PAGE_SIZE, pages), next_since
+
+    def apply_delta(self, delta: bytes):
+        """
+        Sets every bit set in a delta exported by `export_delta` of a filter with the same size and hashing.
+        """
+        header, pages = decode_delta(delta)
+        check_delta(header, self._array_size, self._optimal_hash, self.hash_engine)
+
+        page_bits = header['page_size'] * 8
+        with self.lock:
+            for page, packed in pages:
+                start = page * page_bits
+                self._or_bits(start, packed[:(min(start + page_bits, self._array_size) - start + 7) // 8])
+            self._merge_capacity(header['capacity'])
+
+    @abstractmethod
+    def _fold(self, factor: int):
+        """
+        OR-s the `factor` slices of the bit array into the first one, which becomes the new bit array. Called holding
+        the lock.
+        """
+        raise NotImplementedError('Not implemented yet!')
+
+    def fold(self, factor=2):
+        """
+        Shrinks the filter to `1 / factor` of its size without rehashing, at the cost of a higher false positive
+        probability. Bit indexes are `hash % size`, so they are kept only if the new size divides the current one.\n
+        :param factor: Integer >= 2 that divides the size of the filter.
+        """
+        if not isinstance(factor, int) or factor < 2 or self._array_size % factor:
+            raise BloomFilterException('Filter of {} bits cannot be folded by {!r}. Factor must be an integer >= 2 '
+                                       'that divides the size of the filter.'.format(self._array_size, factor))
+
+        with self.lock:
+            self._fold(factor)
+            self._array_size //= factor
+
+            # Every bit may have moved, so any delta exported from now on carries every page with bits set. Replicas
+            # must be folded too before applying it
+            self._epoch += 1
+            page_bits = self.DELTA_PAGE_SIZE * 8
+            self._dirty = {page: self._epoch for page, start in enumerate(range(0, self._array_size, page_bits))
+                           if self._read_bits(start, min(start + page_bits, self._array_size)).any()}
+        return self
+
+    def _read_bits(self, start: int, stop: int):
+        """
+        Reads a range of bits of the filter.\n
+        :param start: First bit of the range. It must be multiple of 8.
+        :param stop: Last bit (not included) of the range. It must be multiple of 8 or the size of the filter.
+        :return: Numpy uint8 array with the bits packed as `np.packbits` does.
+        """
+        raise NotImplementedError('Not implemented yet!')
+
+    def _or_bits(self, start: int, packed):
+        """
+        Sets every bit set in `packed`, keeping the bits already set in the filter.\n
+        :param start: First bit of the range. It must be multiple of 8.
+        :param packed: Numpy uint8 array with the bits packed as `np.packbits` does.
+        """
+        raise NotImplementedError('Not implemented yet!')
+
+    def dump(self, path: str):
+        """
+        Saves the filter into a numpy `.npz` file. Only chunks with any bit set are written.\n
+        :param path: Path of the file.
+        """
+        metadata = dict(array_size=self._array_size, hash_size=self._optimal_hash, filter_size=self._filter_size,
+                        capacity=self._capacity, hash_engine=self.hash_engine)
+        chunk_bits = DUMP_CHUNK_SIZE * 8
+        chunks, data = [], []
+        with self.lock:
+            for chunk, start in enumerate(range(0, self._array_size, chunk_bits)):
+                packed = self._read_bits(start, min(start + chunk_bits, self._array_size))
+                if packed.any():
+                    chunks.append(chunk)
+                    data.append(np.pad(packed, (0, DUMP_CHUNK_SIZE - len(packed)), 'constant'))
+
+        np.savez_compressed(path, metadata=np.array(json.dumps(metadata)), chunks=np.array(chunks, dtype=np.int64),
+                            data=np.array(data, dtype=np.uint8).reshape(len(data), DUMP_CHUNK_SIZE))
+
+    @classmethod
+    def load(cls, path: str, **kwargs):
+        """
+        Builds a filter from a file written by `dump`.\n
+        :param path: Path of the file.
+        :param kwargs: Extra arguments of the backend. If `hash_engine` is given, it must be the one of the dump.
+        """
+        hash_engine = kwargs.pop('hash_engine', None)
+        with np.load(path) as dump:
+            metadata = json.loads(str(dump['metadata']))
+            if hash_engine is not None and hash_engine != metadata['hash_engine']:
+                raise BloomFilterException('Filter {!r} was dumped with {!r} hash engine, but {!r} was requested.'.
+                                           format(path, metadata['hash_engine'], hash_engine))
+
+            backend = cls(metadata['array_size'], metadata['hash_size'], metadata['filter_size'],
+                          hash_engine=metadata['hash_engine'], **kwargs)
+            chunk_bits = DUMP_CHUNK_SIZE * 8
+            for chunk, packed in zip(dump['chunks'], dump['data']):
+                start = int(chunk) * chunk_bits
+                stop = min(start + chunk_bits, backend._array_size)
+                backend._or_bits(start, packed[:(stop - start + 7) // 8])
+
+        backend._capacity = metadata['capacity']
+        return backend
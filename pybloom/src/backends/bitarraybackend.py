@@ -1,3 +1,4 @@
+import numpy as np
 from bitarray import bitarray as Bitarray
 
 from pybloom.src import BloomFilterException
@@ -5,28 +6,82 @@ from pybloom.src.backends import ThreadingBackend
 
 
 class BitArrayBackend(ThreadingBackend):
-    def __init__(self, array_size: int, hash_size: int, filter_size: int, **kwargs):
+    def __init__(self, array_size: int, hash_size: int, filter_size: int, hash_engine='murmur3', **kwargs):
         self._array = Bitarray(array_size)
 
-        super(BitArrayBackend, self).__init__(array_size, hash_size, filter_size)
+        super(BitArrayBackend, self).__init__(array_size, hash_size, filter_size, hash_engine=hash_engine)
 
     def _add(self, other):
+        self._test_and_set(other)
+        return self
+
+    def _test_and_set(self, other):
         with self.lock:
             if self.full:
                 raise BloomFilterException('Filter is full')
 
-            if other not in self:
-                for idx in self._filter_it(other):
-                    self._array[idx] = 1
+            # Hashed holding the lock, so `fold` cannot change the size of the filter in between
+            indexes = self._filter_it(other)
+            new = False
+            for idx in indexes:
+                new |= not self._array[idx]
+                self._array[idx] = 1
+
+            if new:
+                self._mark_dirty(indexes)
                 self._capacity += 1
-        return self
+        return new
+
+    def _test_and_set_indexes(self, indexes):
+        mask = np.zeros(len(indexes), dtype=bool)
+        with self.lock:
+            # Indexes may be reduced to the size before a `fold`, which is a multiple of the current one
+            indexes = (indexes % self._array_size).tolist()
+            pending = set()  # bits set by previous items of the same batch
+            for row, idxs in enumerate(indexes):
+                mask[row] = not all(self._array[idx] or idx in pending for idx in idxs)
+                pending.update(idxs)
+
+            added = int(mask.sum())
+            self._check_room(added)
+
+            for idx in pending:
+                self._array[idx] = 1
+            self._mark_dirty(list(pending))
+            self._capacity += added
+        return mask
+
+    def _fold(self, factor):
+        size = self._array_size // factor
+        folded = self._array[:size]
+        for start in range(size, self._array_size, size):
+            folded |= self._array[start:start + size]
+        self._array = folded
 
     def reset(self):
         with self.lock:
             self._array.setall(0)
+            self._capacity = 0
+
+    @property
+    def resident_size(self):
+        return self._array.buffer_info()[1]
+
+    def _read_bits(self, start, stop):
+        return np.frombuffer(self._array[start:stop].tobytes(), dtype=np.uint8)
+
+    def _or_bits(self, start, packed):
+        bits = Bitarray()
+        bits.frombytes(packed.tobytes())
+        bits = bits[:self._array_size - start]
+        with self.lock:
+            self._array[start:start + len(bits)] |= bits
+            self._mark_dirty(start + np.flatnonzero(np.unpackbits(packed)[:len(bits)]))
 
     def __contains__(self, item):
-        for idx in self._filter_it(item):
-            if not self._array[idx]:
+        # Lookups do not take the lock: `fold` swaps the array, so the size is taken from the same reference
+        array = self._array
+        for idx in self._filter_it(item, len(array)):
+            if not array[idx]:
                 return False
         return True
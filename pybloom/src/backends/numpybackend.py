@@ -1,29 +1,72 @@
 import numpy as np
 
 from pybloom.src import BloomFilterException
-from pybloom.src.backends import ThreadingBackend
+from pybloom.src.backends import ThreadingBackend, new_rows_mask
 
 
 class NumpyBackend(ThreadingBackend):
-    def __init__(self, array_size: int, hash_size: int, filter_size: int, **kwargs):
+    def __init__(self, array_size: int, hash_size: int, filter_size: int, hash_engine='murmur3', **kwargs):
         self._array = None
 
-        super(NumpyBackend, self).__init__(array_size, hash_size, filter_size)
+        super(NumpyBackend, self).__init__(array_size, hash_size, filter_size, hash_engine=hash_engine)
 
     def _add(self, other):
+        self._test_and_set(other)
+        return self
+
+    def _test_and_set(self, other):
         with self.lock:
             if self.full:
                 raise BloomFilterException('Filter is full')
 
-            if other not in self:
-                self._array[self._filter_it(other)] = 1
+            # Hashed holding the lock, so `fold` cannot change the size of the filter in between
+            indexes = self._filter_it(other)
+            new = not np.all(self._array[indexes])
+            if new:
+                self._array[indexes] = 1
+                self._mark_dirty(indexes)
                 self._capacity += 1
+        return new
 
-        return self
+    def _test_and_set_indexes(self, indexes):
+        with self.lock:
+            # Indexes may be reduced to the size before a `fold`, which is a multiple of the current one
+            indexes = indexes % self._array_size
+            mask = new_rows_mask(indexes, self._array[indexes])
+            added = int(mask.sum())
+            self._check_room(added)
+
+            self._array[indexes[mask]] = 1
+            self._mark_dirty(indexes[mask])
+            self._capacity += added
+        return mask
+
+    def _fold(self, factor):
+        self._array = np.bitwise_or.reduce(self._array.reshape(factor, -1), axis=0)
 
     def reset(self):
         with self.lock:
             self._array = np.zeros(self._array_size, dtype=np.int8)
+            self._capacity = 0
+
+    @property
+    def resident_size(self):
+        return self._array.nbytes
+
+    def _read_bits(self, start, stop):
+        return np.packbits(self._array[start:stop])
+
+    def _or_bits(self, start, packed):
+        bits = np.unpackbits(packed)[:self._array_size - start]
+        with self.lock:
+            self._array[start:start + len(bits)] |= bits.astype(np.int8)
+            self._mark_dirty(start + np.flatnonzero(bits))
 
     def __contains__(self, item):
-        return np.all(self._array[self._filter_it(item)])
+        # Lookups do not take the lock: `fold` swaps the array, so the size is taken from the same reference
+        array = self._array
+        return np.all(array[self._filter_it(item, len(array))])
+
+    def contains_many(self, items):
+        array = self._array
+        return np.all(array[self._filter_many(list(items), len(array))], axis=1)
@@ -0,0 +1,143 @@
+import numpy as np
+
+from pybloom.src import BloomFilterException
+from pybloom.src.backends import ThreadingBackend, new_rows_mask
+
+
+class PagedBackend(ThreadingBackend):
+    """
+    Local backend that splits the bit array in fixed-size pages, allocated on first write. Bits of pages not
+    allocated yet are 0, so resident memory grows with the fill of the filter and `reset` just drops the page table.
+    """
+
+    def __init__(self, array_size: int, hash_size: int, filter_size: int, hash_engine='murmur3', page_size=2 ** 16,
+                 **kwargs):
+        self._pages = None
+        self._page_size = page_size  # bytes per page
+        self._page_bits = page_size * 8
+
+        super(PagedBackend, self).__init__(array_size, hash_size, filter_size, hash_engine=hash_engine)
+
+    @property
+    def resident_size(self):
+        """
+        Number of bytes currently allocated by the pages of the filter.
+        """
+        return len(self._pages) * self._page_size
+
+    def _split(self, indexes):
+        """
+        Groups bit indexes by page with a single sort.\n
+        :param indexes: Numpy array of bit indexes.
+        :return: Generator of (page number, positions in the flattened `indexes`, bytes offsets, bit masks).
+        """
+        pages, bits = np.divmod(np.ravel(indexes), self._page_bits)
+        if not len(pages):
+            return
+
+        order = np.argsort(pages, kind='stable')
+        for positions in np.split(order, np.flatnonzero(np.diff(pages[order])) + 1):
+            page_bits = bits[positions]
+            masks = np.right_shift(0x80, page_bits & 7).astype(np.uint8)
+            yield int(pages[positions[0]]), positions, page_bits >> 3, masks
+
+    def _get_bits(self, indexes):
+        bits = np.zeros(np.size(indexes), dtype=bool)
+        for page, positions, offsets, masks in self._split(indexes):
+            data = self._pages.get(page)
+            if data is not None:
+                bits[positions] = (data[offsets] & masks) != 0
+        return bits.reshape(np.shape(indexes))
+
+    def _set_bits(self, indexes):
+        self._mark_dirty(indexes)
+        for page, _, offsets, masks in self._split(indexes):
+            data = self._pages.get(page)
+            if data is None:
+                data = self._pages[page] = np.zeros(self._page_size, dtype=np.uint8)
+            np.bitwise_or.at(data, offsets, masks)
+
+    def _add(self, other):
+        self._test_and_set(other)
+        return self
+
+    def _test_and_set(self, other):
+        with self.lock:
+            if self.full:
+                raise BloomFilterException('Filter is full')
+
+            # Hashed holding the lock, so `fold` cannot change the size of the filter in between
+            indexes = self._filter_it(other)
+            new = not np.all(self._get_bits(indexes))
+            if new:
+                self._set_bits(indexes)
+                self._capacity += 1
+        return new
+
+    def _test_and_set_indexes(self, indexes):
+        with self.lock:
+            # Indexes may be reduced to the size before a `fold`, which is a multiple of the current one
+            indexes = indexes % self._array_size
+            mask = new_rows_mask(indexes, self._get_bits(indexes))
+            added = int(mask.sum())
+            self._check_room(added)
+
+            self._set_bits(indexes[mask])
+            self._capacity += added
+        return mask
+
+    def _fold(self, factor):
+        size = self._array_size // factor
+        pages, self._pages = self._pages, {}
+        for page, data in pages.items():
+            indexes = page * self._page_bits + np.flatnonzero(np.unpackbits(data))
+            self._set_bits(indexes % size)
+
+    def reset(self):
+        with self.lock:
+            self._pages = {}
+            self._capacity = 0
+
+    def _page_slices(self, start, length):
+        """
+        Splits a range of bytes by page.\n
+        :return: Generator of (page number, start byte inside the page, start byte inside the range, length).
+        """
+        position = start // 8
+        stop = position + length
+        while position < stop:
+            page, offset = divmod(position, self._page_size)
+            size = min(self._page_size - offset, stop - position)
+            yield page, offset, position - start // 8, size
+            position += size
+
+    def _read_bits(self, start, stop):
+        packed = np.zeros((stop - start + 7) // 8, dtype=np.uint8)
+        for page, offset, position, size in self._page_slices(start, len(packed)):
+            data = self._pages.get(page)
+            if data is not None:
+                packed[position:position + size] = data[offset:offset + size]
+        return packed
+
+    def _or_bits(self, start, packed):
+        with self.lock:
+            for page, offset, position, size in self._page_slices(start, len(packed)):
+                chunk = packed[position:position + size]
+                if not chunk.any():
+                    continue
+
+                data = self._pages.get(page)
+                if data is None:
+                    data = self._pages[page] = np.zeros(self._page_size, dtype=np.uint8)
+                data[offset:offset + size] |= chunk
+            self._mark_dirty(start + np.flatnonzero(np.unpackbits(packed)))
+
+    def __contains__(self, item):
+        # `fold` rebuilds the page table in place, so lookups wait for it
+        with self.lock.reading:
+            return np.all(self._get_bits(self._filter_it(item)))
+
+    def contains_many(self, items):
+        items = list(items)
+        with self.lock.reading:
+            return np.all(self._get_bits(self._filter_many(items)), axis=1)
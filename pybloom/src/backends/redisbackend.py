@@ -1,13 +1,17 @@
 import json
 import random
+import threading
 import time
+from collections import OrderedDict
 
+import numpy as np
 import redis
 from redis.exceptions import LockError
 from redis.lock import LuaLock as lock
 
 from pybloom.src import BloomFilterException
-from pybloom.src.backends import SharedBackend
+from pybloom.src.backends import SharedBackend, ThreadingBackend
+from pybloom.src.delta import check_delta, decode_delta
 
 
 def retry(retries, exceptions, max_retry_wait=30):
@@ -33,23 +37,57 @@ def retry(retries, exceptions, max_retry_wait=30):
     return inner_function
 
 
+_connection_pools = {}
+_connection_pools_lock = threading.Lock()
+
+
+def get_connection_pool(redis_connection: str, decode_responses=True):
+    """
+    Returns the process-wide connection pool for a redis url, so every filter pointing to the same server shares
+    its connections.\n
+    :param redis_connection: Url for redis connection as accepted by redis-py.
+    :param decode_responses: Whether responses are decoded into str or returned as bytes.
+    """
+    with _connection_pools_lock:
+        pool = _connection_pools.get((redis_connection, decode_responses))
+        if pool is None:
+            pool = redis.ConnectionPool.from_url(redis_connection, decode_responses=decode_responses)
+            _connection_pools[(redis_connection, decode_responses)] = pool
+        return pool
+
+
 class BaseProxy(object):
     MAX_RETRY_WAIT = 30  # seconds
 
     def __init__(self, retries=3, max_retry_wait=None):
         self._retries = retries
         self.MAX_RETRY_WAIT = max_retry_wait or self.MAX_RETRY_WAIT
+        self._pipelines = threading.local()
 
     def as_pipeline(self):
-        return RedisPipelineProxy(self._connection)
+        """
+        Returns a pipeline bound to the current thread. It is reused by every `with` block of the thread, unless it
+        is already in use by an outer block.
+        """
+        pipeline = getattr(self._pipelines, 'pipeline', None)
+        if pipeline is None:
+            pipeline = self._pipelines.pipeline = RedisPipelineProxy(self._connection, self._retries,
+                                                                     self.MAX_RETRY_WAIT)
+        elif pipeline.in_use:
+            pipeline = RedisPipelineProxy(self._connection, self._retries, self.MAX_RETRY_WAIT)
+        return pipeline
 
     def __getattr__(self, item):
         method = getattr(self._connection, item)
 
+        # Lua scripts (i.e. the non-idempotent add scripts) are registered through this proxy, but their calls go
+        # straight to the connection, so they are never retried.
         @retry(self._retries, (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError), self.MAX_RETRY_WAIT)
         def exec_command(*args, **kwargs):
             return method(*args, **kwargs)
 
+        # Cache the wrapper, so next accesses don't go through __getattr__ anymore
+        setattr(self, item, exec_command)
         return exec_command
 
 
@@ -58,25 +96,121 @@ class RedisPipelineProxy(BaseProxy):
         self._connection = redis_connection.pipeline()
         self._reset = self._connection.reset
         self._connection.reset = lambda: None  # Monkey patch reset
+        self.in_use = False
 
         super(RedisPipelineProxy, self).__init__(retries, max_retry_wait)
 
     def __enter__(self):
+        self.in_use = True
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         self._reset()
+        self.in_use = False
 
 
 class RedisProxy(BaseProxy):
-    def __init__(self, redis_connection: str, retries=3, max_retry_wait=None):
-        self._connection = redis.StrictRedis.from_url(redis_connection, decode_responses=True)
+    def __init__(self, redis_connection: str, retries=3, max_retry_wait=None, decode_responses=True):
+        self._connection = redis.StrictRedis(connection_pool=get_connection_pool(redis_connection, decode_responses))
         super(RedisProxy, self).__init__(retries, max_retry_wait)
 
+
+class PageCache(object):
+    """
+    Local LRU cache of fixed-size pages of the filter bitmaps, bounded by a byte budget. Pages older than `ttl`
+    seconds are considered expired and discarded on access.
+    """
+
+    def __init__(self, max_bytes: int, page_size: int, ttl: float):
+        self._max_bytes = max_bytes
+        self._page_size = page_size  # bytes per page
+        self._ttl = ttl
+        self._pages = OrderedDict()  # (key, page) -> (bytearray, fetched_at)
+        self._size = 0
+        self._lock = threading.Lock()
+        self.generation = None
+
+    @property
+    def page_bits(self):
+        return self._page_size * 8
+
+    def page_range(self, page):
+        start = page * self._page_size
+        return start, start + self._page_size - 1
+
+    def get(self, key, page):
+        with self._lock:
+            entry = self._pages.get((key, page))
+            if entry is None:
+                return None
+
+            if time.time() - entry[1] > self._ttl:
+                self._discard((key, page))
+                return None
+
+            self._pages.move_to_end((key, page))
+            return entry[0]
+
+    def put(self, key, page, data):
+        with self._lock:
+            self._discard((key, page))
+            self._pages[(key, page)] = (bytearray(data), time.time())
+            self._size += len(data)
+
+            while self._size > self._max_bytes and self._pages:
+                self._discard(next(iter(self._pages)))
+
+    def set_bit(self, key, offset):
+        """
+        Sets a bit in a cached page (if present), so a client always sees its own writes.
+        """
+        page, bit = divmod(offset, self.page_bits)
+        with self._lock:
+            entry = self._pages.get((key, page))
+            if entry is not None and bit // 8 < len(entry[0]):
+                entry[0][bit // 8] |= 1 << (7 - bit % 8)
+
+    def or_bytes(self, key, start, data):
+        """
+        OR-s a range of bytes into the cached pages it overlaps (if present), so a client always sees its own writes.
+        """
+        data = np.frombuffer(data, dtype=np.uint8)
+        position, stop = start, start + len(data)
+        with self._lock:
+            while position < stop:
+                page, offset = divmod(position, self._page_size)
+                size = min(self._page_size - offset, stop - position)
+                entry = self._pages.get((key, page))
+                if entry is not None:
+                    # The string is at least as long as the range now, even if it was shorter when it was fetched
+                    missing = offset + size - len(entry[0])
+                    if missing > 0:
+                        entry[0].extend(bytes(missing))
+                        self._size += missing
+
+                    cached = np.frombuffer(entry[0], dtype=np.uint8)
+                    cached[offset:offset + size] |= data[position - start:position - start + size]
+                position += size
+
+    def clear(self):
+        with self._lock:
+            self._pages.clear()
+            self._size = 0
+
+    def _discard(self, page_key):
+        entry = self._pages.pop(page_key, None)
+        if entry is not None:
+            self._size -= len(entry[0])
+
+    @staticmethod
+    def bit(data, bit):
+        # GETRANGE stops at the end of the string, and missing bytes are zeros in redis
+        return bit // 8 < len(data) and bool(data[bit // 8] & (1 << (7 - bit % 8)))
+
+
 LUA_ADD_KEY = """
     local capacity = tonumber(redis.call('HGET', KEYS[1], 'capacity'))
     local filter_size = tonumber(redis.call('HGET', KEYS[1], 'filter_size'))
-    local hash_size = tonumber(redis.call('HGET', KEYS[1], 'hash_size'))
 
     -- This means that filter has been reset
     if capacity == nil or filter_size == nil then
@@ -87,53 +221,142 @@ LUA_ADD_KEY = """
         return false
     end
 
-    local sum = 0
+    -- SETBIT returns the previous value of the bit, so bits are read and written in the same pass
+    local new = 0
     for i=1, #ARGV do
         local args = cjson.decode(ARGV[i])
-        if redis.call('GETBIT', args['key'], args['offset']) == 1 then
-            sum = sum + 1
+        if redis.call('SETBIT', args['key'], args['offset'], 1) == 0 then
+            new = 1
         end
-
-        redis.call('SETBIT', args['key'], args['offset'], 1)
     end
 
     -- Only if the element don't exists, increase the capacity (i.e. add it)
-    if sum ~= hash_size then
+    if new == 1 then
         capacity = capacity + 1
         redis.call('HSET', KEYS[1], 'capacity', capacity)
     end
 
+    return {capacity, new}
+"""
+
+LUA_ADD_MANY_KEYS = """
+    local capacity = tonumber(redis.call('HGET', KEYS[1], 'capacity'))
+    local filter_size = tonumber(redis.call('HGET', KEYS[1], 'filter_size'))
+
+    -- This means that filter has been reset
+    if capacity == nil or filter_size == nil then
+        return false
+    end
+
+    -- First pass: find out which elements are new, taking into account bits set by previous elements of the batch
+    local items = {}
+    local pending = {}
+    local added = 0
+    local response = {}
+    for i=1, #ARGV do
+        local bits = cjson.decode(ARGV[i])
+        local new = 0
+        for j=1, #bits do
+            local bit = bits[j]['key'] .. ':' .. bits[j]['offset']
+            if not pending[bit] and redis.call('GETBIT', bits[j]['key'], bits[j]['offset']) == 0 then
+                new = 1
+            end
+            pending[bit] = true
+        end
+        items[i] = bits
+        added = added + new
+        response[i + 1] = new
+    end
+
+    if capacity + added > filter_size then
+        return false
+    end
+
+    -- Second pass: set the bits of every element
+    for i=1, #items do
+        for j=1, #items[i] do
+            redis.call('SETBIT', items[i][j]['key'], items[i][j]['offset'], 1)
+        end
+    end
+
+    capacity = capacity + added
+    redis.call('HSET', KEYS[1], 'capacity', capacity)
+    response[1] = capacity
+
+    return response
+"""
+
+LUA_SET_BITS = """
+    local capacity = tonumber(redis.call('HGET', KEYS[1], 'capacity'))
+
+    -- This means that filter has been reset
+    if capacity == nil then
+        return false
+    end
+
+    -- Every range takes 3 arguments: segment key, first byte and the bytes to OR into the segment
+    for i=2, #ARGV, 3 do
+        local first = tonumber(ARGV[i + 1])
+        local data = ARGV[i + 2]
+        local current = redis.call('GETRANGE', ARGV[i], first, first + #data - 1)
+
+        local bytes = {}
+        for j=1, #data do
+            -- GETRANGE stops at the end of the string, and missing bytes are zeros
+            bytes[j] = string.char(bit.bor(string.byte(current, j) or 0, string.byte(data, j)))
+        end
+        redis.call('SETRANGE', ARGV[i], first, table.concat(bytes))
+    end
+
+    -- A delta carries the capacity of its source filter
+    capacity = math.max(capacity, tonumber(ARGV[1]))
+    redis.call('HSET', KEYS[1], 'capacity', capacity)
     return capacity
 """
 
 
 class RedisBackend(SharedBackend):
     def __init__(self, array_size: int, hash_size: int, filter_size: int, redis_connection: str, connection_retries=3,
-                 wait=None, prefix_key='bloom_filter'):
+                 wait=None, prefix_key='bloom_filter', cache_size=0, cache_page_size=4096, cache_ttl=60,
+                 cache_strict=True, hash_engine='murmur3'):
         self._max_redis_offset_size = 2 ** 32 - 1
         self._key = prefix_key
         self._metadata_key = '{}_metadata'.format(self._key)
         self._lock_key = 'bloom_filter_lock'
         self._lock_timeout = 10
 
-        # Wrap connection in redis proxy
+        # Wrap connection in redis proxy. Raw proxy returns bytes, for commands that read bitmaps
         self._redis = RedisProxy(redis_connection,
                                  retries=connection_retries,
                                  max_retry_wait=wait)
+        self._raw_redis = RedisProxy(redis_connection,
+                                     retries=connection_retries,
+                                     max_retry_wait=wait,
+                                     decode_responses=False)
+
+        # Optional local cache of bitmap pages used by lookups
+        self._cache = None
+        self._cache_strict = cache_strict
+        if cache_size > 0:
+            self._cache = PageCache(cache_size, cache_page_size, cache_ttl)
 
         self._lua_add = self._redis.register_script(LUA_ADD_KEY)
-        array_size, hash_size, filter_size, capacity = self._retrieve_metadata(array_size, hash_size, filter_size)
-        super(RedisBackend, self).__init__(array_size, hash_size, filter_size, capacity)
+        self._lua_add_many = self._redis.register_script(LUA_ADD_MANY_KEYS)
+        self._lua_set_bits = self._redis.register_script(LUA_SET_BITS)
+        array_size, hash_size, filter_size, capacity = self._retrieve_metadata(array_size, hash_size, filter_size,
+                                                                               hash_engine)
+        super(RedisBackend, self).__init__(array_size, hash_size, filter_size, capacity, hash_engine=hash_engine)
 
-    def _retrieve_metadata(self, array_size, hash_size, filter_size):
+    def _retrieve_metadata(self, array_size, hash_size, filter_size, hash_engine):
         try:
             with lock(self._redis, self._lock_key, timeout=self._lock_timeout):
-                metadata = dict(array_size=array_size, hash_size=hash_size, filter_size=filter_size, capacity=0)
+                metadata = dict(array_size=array_size, hash_size=hash_size, filter_size=filter_size, capacity=0,
+                                hash_engine=hash_engine)
                 _redis_metadata = self._redis.hgetall(self._metadata_key)
                 if not _redis_metadata:
                     self._redis.hmset(self._metadata_key, metadata)
 
-                return map(lambda x: int(x), (_redis_metadata or metadata).values())
+                metadata = _redis_metadata or metadata
         except LockError:
             raise BloomFilterException(
                 'Cannot retrieve metadata from redis. Seems another process has acquired the lock'
@@ -141,22 +364,38 @@ class RedisBackend(SharedBackend):
                 format(self._lock_key)
             )
 
+        # Filters created before hash engines were selectable always used murmur3
+        if metadata.get('hash_engine', 'murmur3') != hash_engine:
+            raise BloomFilterException('Filter {!r} was built with {!r} hash engine, but {!r} was requested.'.
+                                       format(self._key, metadata.get('hash_engine', 'murmur3'), hash_engine))
+
+        return (int(metadata[field]) for field in ('array_size', 'hash_size', 'filter_size', 'capacity'))
+
     def _build_key(self, offset):
         return '{}:{}'.format(self._key, offset)
 
     def _get_right_offset(self, value):
         name_to_key = int(value / self._max_redis_offset_size) + 1
-        offset = ((name_to_key * 2 ** 32) - 1)
+        offset = ((name_to_key * (self._max_redis_offset_size + 1)) - 1)
         return name_to_key, offset
 
+    def _bits_metadata(self, indexes):
+        metadata = []
+        for idx in indexes:
+            _name_to_key, _offset = self._get_right_offset(idx)
+            metadata.append(dict(key=self._build_key(_name_to_key), offset=int(_offset - 1 - idx)))
+        return metadata
+
     def _add(self, other):
+        self._test_and_set(other)
+        return self
+
+    def _test_and_set(self, other):
         if self.full:
             raise BloomFilterException('Filter is full')
 
-        metadata = []
-        for idx in self._filter_it(other):
-            _name_to_key, _offset = self._get_right_offset(idx)
-            metadata.append(json.dumps(dict(key=self._build_key(_name_to_key), offset=int(_offset - 1 - idx))))
+        bits = self._bits_metadata(self._filter_it(other))
+        metadata = [json.dumps(bit) for bit in bits]
 
         _server_response = self._lua_add(keys=[self._metadata_key], args=metadata)
         if _server_response is None:
@@ -164,24 +403,196 @@ class RedisBackend(SharedBackend):
                                        'This can be because another process already filled the filter or '
                                        'has been reset.'.format(other))
 
-        self._capacity = _server_response or self._capacity
-        return self
+        self._capacity, new = _server_response
+        self._cache_bits(bits)
+        return bool(new)
+
+    def _test_and_set_indexes(self, indexes):
+        if not len(indexes):
+            return np.zeros(0, dtype=bool)
+
+        bits = [self._bits_metadata(item_indexes) for item_indexes in indexes]
+        metadata = [json.dumps(item_bits) for item_bits in bits]
+        _server_response = self._lua_add_many(keys=[self._metadata_key], args=metadata)
+        if _server_response is None:
+            raise BloomFilterException('Values have not been added. '
+                                       'This can be because the filter has not enough room for them or '
+                                       'has been reset.')
+
+        self._capacity = _server_response[0]
+        for item_bits in bits:
+            self._cache_bits(item_bits)
+        return np.array(_server_response[1:], dtype=bool)
+
+    def apply_delta(self, delta: bytes):
+        """
+        Sets every bit set in a delta exported by `export_delta` of a local filter with the same size and hashing.
+        Every page is sent in its own script call, so memory and script duration are bounded by the page size.
+        """
+        header, pages = decode_delta(delta)
+        check_delta(header, self._array_size, self._optimal_hash, self.hash_engine)
+
+        page_bits = header['page_size'] * 8
+        for page, packed in pages:
+            self._or_bits(page * page_bits, packed, header['capacity'])
+
+    def _segments(self, start, stop):
+        """
+        Splits a range of bits by segment key.\n
+        :return: Generator of (key, lowest redis offset, highest redis offset, first bit, last bit not included).
+        Redis offsets are stored in reverse order, so the lowest offset belongs to the last bit.
+        """
+        while start < stop:
+            name_to_key, offset = self._get_right_offset(start)
+            end = min(stop, name_to_key * self._max_redis_offset_size)
+            yield self._build_key(name_to_key), offset - end, offset - 1 - start, start, end
+            start = end
+
+    def _read_bits(self, start, stop):
+        """
+        Reads a range of bits with one GETRANGE per segment key, in a single round trip.\n
+        :return: Numpy uint8 array with the bits packed as `np.packbits` does.
+        """
+        segments = list(self._segments(start, stop))
+        with self._raw_redis.as_pipeline() as pipe:
+            for key, low, high, _, _ in segments:
+                pipe.getrange(key, low // 8, high // 8)
+            response = pipe.execute()
+
+        bits = []
+        for (key, low, high, _, _), data in zip(segments, response):
+            # GETRANGE stops at the end of the string, and missing bytes are zeros in redis
+            data = data.ljust(high // 8 - low // 8 + 1, b'\0')
+            first = low % 8
+            bits.append(np.unpackbits(np.frombuffer(data, dtype=np.uint8))[first:first + high - low + 1][::-1])
+        return np.packbits(np.concatenate(bits)) if bits else np.zeros(0, dtype=np.uint8)
+
+    def _or_bits(self, start, packed, capacity=0):
+        """
+        Sets every bit set in `packed`, with one script call per `ThreadingBackend.DELTA_PAGE_SIZE` bytes, so a single
+        call never blocks redis for long. Pages without any bit set are skipped.\n
+        :param start: First bit of the range. It must be multiple of 8.
+        :param packed: Numpy uint8 array with the bits packed as `np.packbits` does.
+        :param capacity: Capacity of the filter the bits come from. Capacity of the filter is raised to it if lower.
+        """
+        page_size = ThreadingBackend.DELTA_PAGE_SIZE
+        positions = [position for position in range(0, len(packed), page_size)
+                     if packed[position:position + page_size].any()]
+
+        # At least one call, so the capacity is merged even if there are no bits to set
+        for position in positions or [0]:
+            self._or_page(start + position * 8, packed[position:position + page_size], capacity)
+
+    def _or_page(self, start, packed, capacity):
+        """
+        Sets the bits of a page with a single script call, which OR-s one range of bytes per segment key.
+        """
+        bits = np.unpackbits(packed)[:max(self._array_size - start, 0)]
+        ranges = []
+        for key, low, high, first, end in self._segments(start, start + len(bits)):
+            # Redis offsets are stored in reverse order, and ranges are aligned to whole bytes of the segment
+            segment = bits[first - start:end - start][::-1]
+            if segment.any():
+                data = np.packbits(np.concatenate((np.zeros(low % 8, dtype=np.uint8), segment)))
+                ranges.append((key, low // 8, data.tobytes()))
+
+        args = [capacity]
+        for key, first_byte, data in ranges:
+            args.extend((key, first_byte, data))
+
+        _server_response = self._lua_set_bits(keys=[self._metadata_key], args=args)
+        if _server_response is None:
+            raise BloomFilterException('Bits have not been set. Filter metadata is missing.')
+
+        self._capacity = _server_response
+        if self._cache is not None:
+            for key, first_byte, data in ranges:
+                self._cache.or_bytes(key, first_byte, data)
+
+    def _merge_capacity(self, capacity):
+        self._or_bits(0, np.zeros(0, dtype=np.uint8), capacity)
+
+    def _cache_bits(self, bits):
+        if self._cache is not None:
+            for bit in bits:
+                self._cache.set_bit(bit['key'], bit['offset'])
+
+    def _segment_keys(self):
+        last_key, _ = self._get_right_offset(self._array_size - 1)
+        return [self._build_key(name_to_key) for name_to_key in range(1, last_key + 1)]
 
     def reset(self):
-        with self._redis.as_pipeline() as pipe:
-            cursor = '0'
-            while cursor != 0:
-                cursor, data = self._redis.scan(cursor=cursor, match='{}:*'.format(self._key), count=None)
-                for item in data:
-                    pipe.delete(item)
+        """
+        Purges the filter keeping it usable by every client. Segment keys are freed in background with UNLINK
+        (redis >= 4.0) and metadata is re-initialized in the same transaction, under the metadata lock.
+        """
+        metadata = dict(array_size=self._array_size, hash_size=self._optimal_hash, filter_size=self._filter_size,
+                        capacity=0, hash_engine=self.hash_engine)
+        try:
+            with lock(self._redis, self._lock_key, timeout=self._lock_timeout):
+                with self._redis.as_pipeline() as pipe:
+                    pipe.execute_command('UNLINK', *self._segment_keys())
+                    pipe.hmset(self._metadata_key, metadata)
+                    pipe.hincrby(self._metadata_key, 'generation', 1)
+                    pipe.execute()
+        except LockError:
+            raise BloomFilterException(
+                'Cannot reset the filter. Seems another process has acquired the lock'
+                ' and did not released. Check if {!r} key is in your redis server.'.
+                format(self._lock_key)
+            )
 
-            pipe.hdel(self._metadata_key, 'array_size', 'hash_size', 'filter_size', 'capacity')
+        self._capacity = 0
+        if self._cache is not None:
+            self._cache.clear()
+
+    def _cached_contains(self, item):
+        """
+        Lookup served from the local page cache. Set bits are only cleared by `reset`, so cached positives are
+        trusted until the page expires. Cached negatives are trusted only if the cache is not strict, otherwise they
+        are re-checked with GETBIT. Missing pages are fetched with GETRANGE, in the same round trip as the GETBIT
+        calls and the reset generation of the filter: if it has changed, the whole cache is dropped.
+        """
+        missing, unset = [], []
+        for bit in self._bits_metadata(self._filter_it(item)):
+            page, page_bit = divmod(bit['offset'], self._cache.page_bits)
+            data = self._cache.get(bit['key'], page)
+            if data is None:
+                missing.append((bit['key'], page, page_bit))
+            elif not PageCache.bit(data, page_bit):
+                if not self._cache_strict:
+                    return False
+                unset.append(bit)
+
+        if not missing and not unset:
+            return True
+
+        pages = sorted(set((key, page) for key, page, _ in missing))
+        with self._raw_redis.as_pipeline() as pipe:
+            pipe.hget(self._metadata_key, 'generation')
+            for key, page in pages:
+                pipe.getrange(key, *self._cache.page_range(page))
+            for bit in unset:
+                pipe.getbit(bit['key'], bit['offset'])
             response = pipe.execute()
 
-        if response[-1] == 4:
-            self._capacity = 0
+        if response[0] != self._cache.generation:
+            self._cache.clear()
+            self._cache.generation = response[0]
+
+        fetched = dict(zip(pages, response[1:len(pages) + 1]))
+        for (key, page), data in fetched.items():
+            self._cache.put(key, page, data)
+
+        # Bits set by other clients since their pages were cached
+        bits = response[len(pages) + 1:]
+        self._cache_bits(bit for bit, value in zip(unset, bits) if value)
+        return all(bits) and all(PageCache.bit(fetched[(key, page)], page_bit) for key, page, page_bit in missing)
 
     def __contains__(self, item):
+        if self._cache is not None:
+            return self._cached_contains(item)
+
         with self._redis.as_pipeline() as pipe:
             for idx in self._filter_it(item):
                 _name_to_key, _offset = self._get_right_offset(idx)
@@ -189,3 +600,16 @@ class RedisBackend(SharedBackend):
 
             response = pipe.execute()
         return all(response)
+
+    def contains_many(self, items):
+        items = list(items)
+        if self._cache is not None:
+            return np.array([self._cached_contains(item) for item in items], dtype=bool)
+
+        indexes = self._filter_many(items)
+        with self._redis.as_pipeline() as pipe:
+            for bit in self._bits_metadata(indexes.ravel()):
+                pipe.getbit(bit['key'], bit['offset'])
+
+            response = pipe.execute()
+        return np.array(response, dtype=bool).reshape(indexes.shape).all(axis=1)
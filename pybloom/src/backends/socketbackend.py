@@ -0,0 +1,91 @@
+import json
+import socket
+import threading
+
+import numpy as np
+
+from pybloom.src import BloomFilterException
+from pybloom.src import protocol
+from pybloom.src.backends import SharedBackend, chunked
+from pybloom.src.hashing import to_hashable
+
+
+class SocketBackend(SharedBackend):
+    """
+    Client of a filter hosted by `pybloom serve`. Values are hashed by the server, and batches are split in chunks
+    of `batch_size` keys that are sent pipelined: up to `PIPELINE_DEPTH` requests are written before reading the
+    first response.
+    """
+    PIPELINE_DEPTH = 16
+
+    def __init__(self, array_size: int, hash_size: int, filter_size: int, socket_path='/tmp/pybloom.sock',
+                 name='default', batch_size=4096, **kwargs):
+        self._name = name
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self._socket.connect(socket_path)
+        except OSError as e:
+            raise BloomFilterException('Cannot connect to {!r}: {}'.format(socket_path, e))
+
+        # Server metadata wins over the given one, like in RedisBackend
+        try:
+            metadata = json.loads(self._request(protocol.OP_INFO).decode('utf-8'))
+        except BloomFilterException:
+            self._socket.close()
+            raise
+        super(SocketBackend, self).__init__(metadata['array_size'], metadata['hash_size'], metadata['filter_size'],
+                                            metadata['capacity'], hash_engine=metadata['hash_engine'])
+
+    def _request(self, op, body=b''):
+        return self._requests(op, [body])[0]
+
+    def _requests(self, op, bodies):
+        # Every response is read even if one of them is an error, so the connection stays in sync
+        responses = []
+        with self._lock:
+            for sent, body in enumerate(bodies, 1):
+                protocol.send_frame(self._socket, protocol.encode_request(op, self._name, body))
+                if sent - len(responses) == self.PIPELINE_DEPTH:
+                    responses.append(protocol.recv_frame(self._socket))
+
+            while len(responses) < len(bodies):
+                responses.append(protocol.recv_frame(self._socket))
+        return [protocol.decode_response(response) for response in responses]
+
+    def _batch(self, op, items):
+        bodies = [protocol.encode_keys([to_hashable(item) for item in chunk])
+                  for chunk in chunked(items, self._batch_size)]
+
+        masks = []
+        for response in self._requests(op, bodies):
+            self._capacity, = protocol.CAPACITY.unpack_from(response)
+            masks.append(np.frombuffer(response, dtype=np.uint8, offset=protocol.CAPACITY.size).astype(bool))
+        return np.concatenate(masks) if masks else np.zeros(0, dtype=bool)
+
+    def _add(self, other):
+        self._test_and_set(other)
+        return self
+
+    def _test_and_set(self, other):
+        return bool(self._batch(protocol.OP_TEST_AND_SET, [other])[0])
+
+    def _test_and_set_many(self, items):
+        return self._batch(protocol.OP_TEST_AND_SET, items)
+
+    def _test_and_set_indexes(self, indexes):
+        raise BloomFilterException('SocketBackend does not accept hashed values, values are hashed by the server.')
+
+    def reset(self):
+        response = self._request(protocol.OP_RESET)
+        self._capacity, = protocol.CAPACITY.unpack_from(response)
+
+    def __contains__(self, item):
+        return bool(self._batch(protocol.OP_CONTAINS, [item])[0])
+
+    def contains_many(self, items):
+        return self._batch(protocol.OP_CONTAINS, list(items))
+
+    def close(self):
+        self._socket.close()
@@ -6,7 +6,9 @@ import psutil
 from pybloom.src import BloomFilterException
 from pybloom.src.backends.bitarraybackend import BitArrayBackend
 from pybloom.src.backends.numpybackend import NumpyBackend
+from pybloom.src.backends.pagedbackend import PagedBackend
 from pybloom.src.backends.redisbackend import RedisBackend
+from pybloom.src.backends.socketbackend import SocketBackend
 from pybloom.src import log
 
 MAGNITUDES = {
@@ -89,6 +91,13 @@ class BloomFilter(object):
                                                                               human_readable_size.unit))
             return BitArrayBackend(filter_metadata.optimal_size, filter_metadata.optimal_hash,
                                    max_number_of_element_expected, **kwargs)
+        elif backend == 'socket':
+            return SocketBackend(filter_metadata.optimal_size, filter_metadata.optimal_hash,
+                                 max_number_of_element_expected, **kwargs)
+        elif backend == 'paged':
+            # Pages are allocated on first write, so memory is not checked in advance
+            return PagedBackend(filter_metadata.optimal_size, filter_metadata.optimal_hash,
+                                max_number_of_element_expected, **kwargs)
 
         raise BloomFilterException('Backend {!r} not found.'.format(backend))
 
@@ -0,0 +1,349 @@
+import math
+import threading
+from abc import ABCMeta, abstractmethod
+
+import numpy as np
+from redis.exceptions import LockError
+from redis.lock import LuaLock as lock
+
+from pybloom.src import BloomFilterException
+from pybloom.src.backends import Hashing
+from pybloom.src.backends.redisbackend import RedisProxy
+from pybloom.src.hashing import get_hash_engine
+
+LUA_UPDATE_COUNTERS = """
+    local depth = tonumber(ARGV[1])
+    local conservative = ARGV[2] == '1'
+
+    -- Every element takes `depth + 1` arguments: its count and the field of its counter in every row
+    local response = {}
+    for position=3, #ARGV, depth + 1 do
+        local count = tonumber(ARGV[position])
+        local fields = {}
+        for j=1, depth do
+            fields[j] = ARGV[position + j]
+        end
+
+        local estimate = nil
+        if conservative then
+            -- Only counters equal to the minimum are increased
+            local values = redis.call('HMGET', KEYS[1], unpack(fields))
+            for j=1, depth do
+                values[j] = tonumber(values[j]) or 0
+                if estimate == nil or values[j] < estimate then
+                    estimate = values[j]
+                end
+            end
+
+            estimate = estimate + count
+            for j=1, depth do
+                if values[j] < estimate then
+                    redis.call('HSET', KEYS[1], fields[j], estimate)
+                end
+            end
+        else
+            for j=1, depth do
+                local value = redis.call('HINCRBY', KEYS[1], fields[j], count)
+                if estimate == nil or value < estimate then
+                    estimate = value
+                end
+            end
+        end
+
+        response[#response + 1] = estimate
+    end
+
+    return response
+"""
+
+
+def running_sums(keys, increments):
+    """
+    Computes the running sum of the increments of every key: the i-th element is the sum of every `increments[j]`
+    with `j <= i` and `keys[j] == keys[i]`.\n
+    :param keys: Non-empty numpy array of keys.
+    :param increments: Numpy int64 array with the increment of every key.
+    """
+    order = np.argsort(keys, kind='stable')
+    sorted_keys, sorted_increments = keys[order], increments[order]
+    totals = np.cumsum(sorted_increments)
+
+    # Total of the previous keys, subtracted from every element of a key
+    starts = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+    offsets = np.repeat((totals - sorted_increments)[starts], np.diff(np.r_[starts, len(keys)]))
+
+    sums = np.empty_like(totals)
+    sums[order] = totals - offsets
+    return sums
+
+
+class BaseSketch(Hashing):
+    """
+    Count-Min sketch: `depth` rows of `width` counters. Every row uses one of the hashes of the filter hashing path,
+    so `_filter_it` returns the column of a value in every row.
+    """
+    __metaclass__ = ABCMeta
+
+    def __init__(self, width: int, depth: int, hash_engine='murmur3', conservative=True):
+        self._array_size = width
+        self._optimal_hash = depth
+        self._hash_engine = get_hash_engine(hash_engine)
+        self._conservative = conservative
+
+    @property
+    def width(self):
+        return self._array_size
+
+    @property
+    def depth(self):
+        return self._optimal_hash
+
+    @abstractmethod
+    def _update_indexes(self, indexes, counts):
+        """
+        Increases the counters of a batch of already hashed values, one value after another.\n
+        :param indexes: (n, depth) matrix with the column of every value in every row.
+        :param counts: Numpy int64 array with the increment of every value.
+        :return: Numpy int64 array with the estimated frequency of every value after the update.
+        """
+        raise NotImplementedError('Not implemented yet!')
+
+    @abstractmethod
+    def _query_indexes(self, indexes):
+        """
+        Estimates the frequency of a batch of already hashed values.\n
+        :param indexes: (n, depth) matrix with the column of every value in every row.
+        :return: Numpy int64 array with the estimated frequency of every value.
+        """
+        raise NotImplementedError('Not implemented yet!')
+
+    @abstractmethod
+    def reset(self):
+        raise NotImplementedError('Not implemented yet!')
+
+    @staticmethod
+    def _counts(counts, size: int):
+        """
+        Validates the increments of a batch of values.\n
+        :param counts: Increment of every value, either a single number or one per value.
+        :param size: Number of values.
+        :return: Numpy int64 array with the increment of every value.
+        """
+        counts = np.broadcast_to(np.asarray(counts, dtype=np.int64), (size,))
+        negative = np.flatnonzero(counts < 0)
+        if len(negative):
+            raise BloomFilterException('Counts must be non-negative. {!r} found instead.'.
+                                       format(int(counts[negative[0]])))
+        return counts
+
+    def update(self, item, count=1):
+        """
+        Increases the frequency of a value.\n
+        :return: Estimated frequency of the value after the update.
+        """
+        return int(self._update_indexes(self._filter_it(item)[None, :], self._counts(count, 1))[0])
+
+    def update_many(self, items, counts=1):
+        """
+        Increases the frequency of a batch of values.\n
+        :param items: Values to update.
+        :param counts: Increment of every value, either a single number or one per value.
+        :return: Numpy int64 array with the estimated frequency of every value after the update.
+        """
+        items = list(items)
+        counts = self._counts(counts, len(items))
+        return self._update_indexes(self._filter_many(items), counts)
+
+    def query(self, item):
+        return int(self._query_indexes(self._filter_it(item)[None, :])[0])
+
+    def query_many(self, items):
+        return self._query_indexes(self._filter_many(list(items)))
+
+    def __getitem__(self, item):
+        return self.query(item)
+
+    def observe(self, item, bloom_filter, count=1):
+        """
+        Adds a value to `bloom_filter` and increases its frequency in the sketch, hashing it only once.\n
+        :return: Tuple (True if the value was not in the filter before, estimated frequency of the value).
+        """
+        new, estimates = self.observe_many([item], bloom_filter, count)
+        return bool(new[0]), int(estimates[0])
+
+    def observe_many(self, items, bloom_filter, counts=1):
+        """
+        Batch version of `observe`.\n
+        :return: Tuple (boolean numpy array with the values that were new in the filter, numpy int64 array with the
+        estimated frequency of every value).
+        """
+        if bloom_filter.hash_engine != self.hash_engine:
+            raise BloomFilterException('Filter and sketch must use the same hash engine to share hashes. '
+                                       '{!r} and {!r} found.'.format(bloom_filter.hash_engine, self.hash_engine))
+
+        items = list(items)
+        counts = self._counts(counts, len(items))
+
+        # Engines are prefix-consistent, so the first hashes are the same that filter and sketch would compute
+        digests = self._hash_engine.digest_many(items, max(bloom_filter._optimal_hash, self._optimal_hash))
+        filter_indexes = digests[:, :bloom_filter._optimal_hash] % np.uint64(bloom_filter._array_size)
+        sketch_indexes = digests[:, :self._optimal_hash] % np.uint64(self._array_size)
+
+        new = bloom_filter._test_and_set_indexes(filter_indexes.astype(np.int64))
+        return new, self._update_indexes(sketch_indexes.astype(np.int64), counts)
+
+
+class NumpySketch(BaseSketch):
+    """
+    Sketch stored in a (depth, width) numpy array of uint16 or uint32 counters, which saturate at their max value.
+    """
+
+    def __init__(self, width: int, depth: int, dtype='uint32', **kwargs):
+        self._dtype = np.dtype(dtype)
+        if self._dtype not in (np.uint16, np.uint32):
+            raise BloomFilterException('Counters must be uint16 or uint32. {!r} found instead.'.format(dtype))
+
+        self._max_count = np.iinfo(self._dtype).max
+        self._lock = threading.RLock()
+        self._counters = None
+
+        super(NumpySketch, self).__init__(width, depth, **kwargs)
+        self.reset()
+
+    @property
+    def lock(self):
+        return self._lock
+
+    def _update_indexes(self, indexes, counts):
+        if not len(indexes):
+            return np.zeros(0, dtype=np.int64)
+
+        rows = np.broadcast_to(np.arange(self._optimal_hash), indexes.shape)
+        with self.lock:
+            if not self._conservative:
+                # Value of every counter right after the update of its value, as if values were added one by one
+                increments = running_sums((rows * self._array_size + indexes).ravel(),
+                                          np.repeat(counts, self._optimal_hash)).reshape(indexes.shape)
+                values = np.minimum(self._counters[rows, indexes] + increments, self._max_count)
+
+                # Repeated counters keep their last (i.e. highest) value
+                np.maximum.at(self._counters, (rows, indexes), values.astype(self._dtype))
+                return values.min(axis=1)
+
+            estimates = np.zeros(len(indexes), dtype=np.int64)
+            for item, (columns, count) in enumerate(zip(indexes, counts)):
+                current = self._counters[rows[item], columns]
+                estimates[item] = min(int(current.min()) + int(count), self._max_count)
+                self._counters[rows[item], columns] = np.maximum(current, estimates[item])
+        return estimates
+
+    def _query_indexes(self, indexes):
+        rows = np.arange(self._optimal_hash)
+        return self._counters[rows, indexes].min(axis=1).astype(np.int64)
+
+    def reset(self):
+        with self.lock:
+            self._counters = np.zeros((self._optimal_hash, self._array_size), dtype=self._dtype)
+
+
+class RedisSketch(BaseSketch):
+    """
+    Sketch stored in a redis hash with one field per counter. Every update runs in a single Lua script, so updates
+    from several clients are atomic.
+    """
+
+    def __init__(self, width: int, depth: int, redis_connection: str, connection_retries=3, wait=None,
+                 prefix_key='count_min_sketch', **kwargs):
+        self._key = prefix_key
+        self._metadata_key = '{}_metadata'.format(self._key)
+        self._lock_key = 'count_min_sketch_lock'
+        self._lock_timeout = 10
+        self._redis = RedisProxy(redis_connection,
+                                 retries=connection_retries,
+                                 max_retry_wait=wait)
+        self._lua_update = self._redis.register_script(LUA_UPDATE_COUNTERS)
+
+        super(RedisSketch, self).__init__(width, depth, **kwargs)
+        self._check_metadata()
+
+    def _check_metadata(self):
+        """
+        Stores the layout of the sketch in redis, or checks it against the stored one: clients with another width,
+        depth or hash engine would read and write different counters.
+        """
+        metadata = dict(width=self.width, depth=self.depth, hash_engine=self.hash_engine)
+        try:
+            with lock(self._redis, self._lock_key, timeout=self._lock_timeout):
+                _redis_metadata = self._redis.hgetall(self._metadata_key)
+                if not _redis_metadata:
+                    self._redis.hmset(self._metadata_key, metadata)
+        except LockError:
+            raise BloomFilterException(
+                'Cannot retrieve metadata from redis. Seems another process has acquired the lock'
+                ' and did not released. Check if {!r} key is in your redis server.'.
+                format(self._lock_key)
+            )
+
+        if _redis_metadata:
+            stored = (int(_redis_metadata['width']), int(_redis_metadata['depth']), _redis_metadata['hash_engine'])
+            if stored != (self.width, self.depth, self.hash_engine):
+                raise BloomFilterException('Sketch {!r} was built with {} columns, {} rows and {!r} hash engine, but '
+                                           '{} columns, {} rows and {!r} hash engine were requested.'.
+                                           format(self._key, *(stored + (self.width, self.depth, self.hash_engine))))
+
+    def _fields(self, indexes):
+        # Row-major position of every counter
+        return indexes + np.arange(self._optimal_hash, dtype=np.int64) * self._array_size
+
+    def _update_indexes(self, indexes, counts):
+        if not len(indexes):
+            return np.zeros(0, dtype=np.int64)
+
+        args = [self._optimal_hash, int(self._conservative)]
+        for fields, count in zip(self._fields(indexes).tolist(), counts.tolist()):
+            args.append(count)
+            args.extend(fields)
+
+        return np.array(self._lua_update(keys=[self._key], args=args), dtype=np.int64)
+
+    def _query_indexes(self, indexes):
+        if not len(indexes):
+            return np.zeros(0, dtype=np.int64)
+
+        values = self._redis.hmget(self._key, self._fields(indexes).ravel().tolist())
+        values = np.array([int(value or 0) for value in values], dtype=np.int64)
+        return values.reshape(indexes.shape).min(axis=1)
+
+    def reset(self):
+        # Metadata is kept, so the sketch is still usable by every client
+        self._redis.execute_command('UNLINK', self._key)
+
+
+class CountMinSketch(object):
+    def __new__(cls, error_rate=.001, confidence=.99, backend='numpy', **kwargs):
+        """
+        Builds a Count-Min sketch whose estimates exceed the real frequency by at most `error_rate` times the total
+        count with probability `confidence`.\n
+        :param error_rate: Max error relative to the sum of every count.
+        :param confidence: Probability of keeping the error under `error_rate`.
+        :param backend: `numpy` or `redis`.
+        """
+        if error_rate <= 0 or error_rate >= 1:
+            raise BloomFilterException('Error rate must be in range (0, 1). {!r} found instead.'.format(error_rate))
+
+        if confidence <= 0 or confidence >= 1:
+            raise BloomFilterException('Confidence must be in range (0, 1). {!r} found instead.'.format(confidence))
+
+        width, depth = cls.set_optimal_size_of_sketch(error_rate, confidence)
+        if backend == 'numpy':
+            return NumpySketch(width, depth, **kwargs)
+        elif backend == 'redis':
+            return RedisSketch(width, depth, **kwargs)
+
+        raise BloomFilterException('Backend {!r} not found.'.format(backend))
+
+    @classmethod
+    def set_optimal_size_of_sketch(cls, error_rate, confidence):
+        width = math.ceil(math.e / error_rate)
+        depth = math.ceil(math.log(1 / (1 - confidence)))
+        return width, depth
@@ -0,0 +1,58 @@
+"""
+Format of the deltas written by `export_delta`: a zlib compressed buffer with a JSON header (4 bytes big-endian
+length + utf-8) followed by the packed bits of every page, `page_size` bytes each.
+"""
+import json
+import struct
+import zlib
+
+import numpy as np
+
+from pybloom.src import BloomFilterException
+
+HEADER_SIZE = struct.Struct('!I')
+
+
+def encode_delta(metadata: dict, page_size: int, pages: dict):
+    """
+    :param metadata: array_size, hash_size, hash_engine and capacity of the source filter.
+    :param page_size: Bytes per page.
+    :param pages: Page number -> numpy uint8 array of at most `page_size` packed bits.
+    """
+    numbers = sorted(pages)
+    header = dict(metadata, page_size=page_size, pages=numbers)
+    header = json.dumps(header).encode('utf-8')
+
+    data = np.zeros((len(numbers), page_size), dtype=np.uint8)
+    for row, number in enumerate(numbers):
+        data[row, :len(pages[number])] = pages[number]
+    return zlib.compress(HEADER_SIZE.pack(len(header)) + header + data.tobytes())
+
+
+def decode_delta(delta: bytes):
+    """
+    :return: Tuple (header, generator of (page number, numpy uint8 array with the packed bits of the page)).
+    """
+    try:
+        delta = zlib.decompress(delta)
+        header_size, = HEADER_SIZE.unpack_from(delta)
+        header = json.loads(delta[HEADER_SIZE.size:HEADER_SIZE.size + header_size].decode('utf-8'))
+
+        # Truncated deltas do not have `page_size` bytes for every page of the header
+        data = np.frombuffer(delta, dtype=np.uint8, offset=HEADER_SIZE.size + header_size)
+        data = data.reshape(len(header['pages']), header['page_size'])
+    except (zlib.error, struct.error, ValueError, KeyError, TypeError):
+        raise BloomFilterException('Invalid delta.')
+
+    return header, zip(header['pages'], data)
+
+
+def check_delta(header: dict, array_size: int, hash_size: int, hash_engine: str):
+    """
+    Raises BloomFilterException if a delta was exported from a filter with a different layout.
+    """
+    if (header['array_size'], header['hash_size'], header['hash_engine']) != (array_size, hash_size, hash_engine):
+        raise BloomFilterException('Delta of a filter with {} bits, {} hashes and {!r} hash engine cannot be applied '
+                                   'to a filter with {} bits, {} hashes and {!r} hash engine.'.
+                                   format(header['array_size'], header['hash_size'], header['hash_engine'],
+                                          array_size, hash_size, hash_engine))
@@ -0,0 +1,179 @@
+from abc import ABCMeta, abstractmethod
+
+import mmh3
+import numpy as np
+
+from pybloom.src import BloomFilterException
+
+try:
+    import xxhash
+except ImportError:  # xxhash is only needed by XXH3Engine
+    xxhash = None
+
+MASK_64 = 2 ** 64 - 1
+
+
+def to_hashable(value):
+    """
+    Converts a value into the bytes used for hashing: bytes are kept, str is utf-8 encoded and any other value is
+    converted to str first.\n
+    :param value: Value to convert.
+    """
+    if not isinstance(value, (bytes, str)):
+        value = str(value)
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return value
+
+
+def double_hashing(h1, h2, count):
+    """
+    Derives `count` hashes from two 64 bits hashes (Kirsch-Mitzenmacher): g(i) = h1 + i * h2.\n
+    :param h1: Numpy uint64 array with the first hash of every value.
+    :param h2: Numpy uint64 array with the second hash of every value.
+    :param count: Number of hashes per value.
+    :return: (n, count) uint64 matrix.
+    """
+    h2 = h2 | np.uint64(1)  # odd increments visit every position when the size of the filter is a power of 2
+    with np.errstate(over='ignore'):
+        return h1[:, None] + np.arange(count, dtype=np.uint64)[None, :] * h2[:, None]
+
+
+class HashEngine(object):
+    """
+    Computes the raw (unsigned, not reduced to the filter size) hashes of a value. Hashes are prefix-consistent:
+    the first `k` hashes of `digest(value, n)` are equal to `digest(value, k)` for every `k <= n`.
+    """
+    __metaclass__ = ABCMeta
+
+    name = None
+
+    @abstractmethod
+    def digest(self, value, count: int):
+        """
+        Hashes a single value.\n
+        :param value: Value to hash.
+        :param count: Number of hashes.
+        :return: Numpy uint64 array of `count` hashes.
+        """
+        raise NotImplementedError('Not implemented yet!')
+
+    def digest_many(self, values, count: int):
+        """
+        Hashes a batch of values.\n
+        :param values: List of values to hash.
+        :param count: Number of hashes per value.
+        :return: (n, count) uint64 matrix.
+        """
+        a = np.array([self.digest(value, count) for value in values], dtype=np.uint64)
+        return a.reshape(len(values), count)
+
+    def indexes(self, value, count: int, size: int):
+        """
+        Hashes a single value and reduces its hashes to the size of the filter.\n
+        :param value: Value to hash.
+        :param count: Number of hashes.
+        :param size: Size of the filter.
+        :return: Numpy int64 array of `count` bit indexes.
+        """
+        return (self.digest(value, count) % np.uint64(size)).astype(np.int64)
+
+
+class Murmur3Engine(HashEngine):
+    """
+    32 bits murmur3 with seeds 0..k-1. Default engine and the only one available in previous versions.
+    """
+    name = 'murmur3'
+
+    def digest(self, value, count: int):
+        value = to_hashable(value)
+        return np.array([mmh3.hash(value, i, signed=False) for i in range(count)], dtype=np.uint64)
+
+    def indexes(self, value, count: int, size: int):
+        # Reducing python ints avoids the uint64 modulus and cast, which cost more than hashing a single value.
+        # mmh3 encodes str as utf-8 itself, so only other types need converting
+        if not isinstance(value, (bytes, str)):
+            value = str(value)
+        return np.array([mmh3.hash(value, i, signed=False) % size for i in range(count)], dtype=np.int64)
+
+
+class Murmur3x128Engine(HashEngine):
+    """
+    A single 128 bits murmur3 per value, expanded with double hashing.
+    """
+    name = 'murmur3-128'
+
+    def digest(self, value, count: int):
+        return self.digest_many([value], count)[0]
+
+    def digest_many(self, values, count: int):
+        hashes = [mmh3.hash128(to_hashable(value)) for value in values]
+        h1 = np.array([h & MASK_64 for h in hashes], dtype=np.uint64)
+        h2 = np.array([h >> 64 for h in hashes], dtype=np.uint64)
+        return double_hashing(h1, h2, count)
+
+
+class XXH3Engine(HashEngine):
+    """
+    A single 128 bits xxh3 per value, expanded with double hashing. Requires `xxhash` package.
+    """
+    name = 'xxh3'
+
+    def __init__(self):
+        if xxhash is None:
+            raise BloomFilterException('xxh3 hash engine requires xxhash package. Try `pip install xxhash`.')
+
+    def digest(self, value, count: int):
+        return self.digest_many([value], count)[0]
+
+    def digest_many(self, values, count: int):
+        hashes = [xxhash.xxh3_128_intdigest(to_hashable(value)) for value in values]
+        h1 = np.array([h & MASK_64 for h in hashes], dtype=np.uint64)
+        h2 = np.array([h >> 64 for h in hashes], dtype=np.uint64)
+        return double_hashing(h1, h2, count)
+
+
+class VectorizedIntegerEngine(HashEngine):
+    """
+    Hashes integer values (in range [-2**63, 2**64)) with two rounds of splitmix64 computed by numpy over the whole
+    batch, without any Python loop, and expands them with double hashing.
+    """
+    name = 'vectorized'
+
+    @staticmethod
+    def _splitmix64(x):
+        with np.errstate(over='ignore'):
+            x = x + np.uint64(0x9E3779B97F4A7C15)
+            x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+            x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+            return x ^ (x >> np.uint64(31))
+
+    def digest(self, value, count: int):
+        return self.digest_many([value], count)[0]
+
+    def digest_many(self, values, count: int):
+        values = np.asarray(values)
+        if values.size == 0:
+            return np.zeros((0, count), dtype=np.uint64)
+        if values.dtype.kind not in 'iu':
+            raise BloomFilterException('{!r} hash engine only accepts integer values.'.format(self.name))
+
+        h1 = self._splitmix64(values.astype(np.uint64))
+        h2 = self._splitmix64(h1)
+        return double_hashing(h1, h2, count)
+
+
+HASH_ENGINES = {engine.name: engine for engine in (Murmur3Engine, Murmur3x128Engine, XXH3Engine,
+                                                   VectorizedIntegerEngine)}
+
+
+def get_hash_engine(name: str):
+    """
+    Builds a hash engine from its name.\n
+    :param name: One of `HASH_ENGINES` keys.
+    """
+    try:
+        return HASH_ENGINES[name]()
+    except KeyError:
+        raise BloomFilterException('Hash engine {!r} not found. Available engines: {}.'.
+                                   format(name, ', '.join(sorted(HASH_ENGINES))))
@@ -0,0 +1,36 @@
+from pybloom.src import BloomFilterException
+from pybloom.src.backends import ThreadingBackend
+from pybloom.src.backends.redisbackend import RedisBackend
+
+MIGRATION_CHUNK_SIZE = 2 ** 20  # bytes
+
+
+def migrate(src, dst, chunk_size=MIGRATION_CHUNK_SIZE):
+    """
+    Copies every bit of `src` into `dst` chunk by chunk, without rehashing, so memory is bounded by `chunk_size`
+    whatever the size of the filters. Bits already set in `dst` are kept. Both filters must have the same size, number
+    of hashes and hash engine, and they can use any local backend or redis.\n
+    :param src: Filter to copy.
+    :param dst: Filter that receives the bits.
+    :param chunk_size: Bytes copied per step.
+    :return: `dst`.
+    """
+    for backend in (src, dst):
+        if not isinstance(backend, (ThreadingBackend, RedisBackend)):
+            raise BloomFilterException('{} cannot be migrated. Only local and redis backends are supported.'.
+                                       format(type(backend).__name__))
+
+    if (src._array_size, src._optimal_hash, src.hash_engine) != (dst._array_size, dst._optimal_hash, dst.hash_engine):
+        raise BloomFilterException('Filters must have the same size, number of hashes and hash engine. '
+                                   '({}, {}, {!r}) and ({}, {}, {!r}) found.'.
+                                   format(src._array_size, src._optimal_hash, src.hash_engine,
+                                          dst._array_size, dst._optimal_hash, dst.hash_engine))
+
+    chunk_bits = chunk_size * 8
+    for start in range(0, src._array_size, chunk_bits):
+        packed = src._read_bits(start, min(start + chunk_bits, src._array_size))
+        if packed.any():
+            dst._or_bits(start, packed)
+
+    dst._merge_capacity(len(src))
+    return dst
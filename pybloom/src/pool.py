@@ -0,0 +1,151 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from pybloom.src import BloomFilterException
+from pybloom.src.backends import DEDUPE_CHUNK_SIZE, chunked
+from pybloom.src.backends.bitarraybackend import BitArrayBackend
+from pybloom.src.backends.numpybackend import NumpyBackend
+from pybloom.src.backends.pagedbackend import PagedBackend
+from pybloom.src.bloomfilter import BloomFilter
+
+LOCAL_BACKENDS = {
+    'numpy': NumpyBackend,
+    'bitarray': BitArrayBackend,
+    'paged': PagedBackend,
+}
+
+
+class FilterPool(object):
+    """
+    Set of local filters (one per tenant) created on demand. Filters are kept in memory under a total memory budget:
+    when it is exceeded, least recently used filters are dumped into `spill_dir` and loaded again on next access.
+    """
+
+    def __init__(self, max_number_of_element_expected: int, error_rate=.0005, backend='numpy',
+                 memory_budget=2 ** 30, spill_dir=None, **kwargs):
+        if backend not in LOCAL_BACKENDS:
+            raise BloomFilterException('FilterPool only works with local backends ({}). {!r} found instead.'.
+                                       format(', '.join(sorted(LOCAL_BACKENDS)), backend))
+
+        self._max_number_of_element_expected = max_number_of_element_expected
+        self._error_rate = error_rate
+        self._backend = backend
+        self._kwargs = kwargs
+        self._memory_budget = memory_budget  # bytes
+        self._spill_dir = spill_dir or tempfile.mkdtemp(prefix='pybloom-')
+
+        self._filters = OrderedDict()  # resident filters, least recently used first
+        self._spilled = {}  # tenant -> spill file
+        self._lock = threading.RLock()
+
+    @property
+    def resident_size(self):
+        """
+        Number of bytes used by resident filters.
+        """
+        return sum(f.resident_size for f in self._filters.values())
+
+    def __len__(self):
+        return len(self._filters) + len(self._spilled)
+
+    def __getitem__(self, tenant):
+        return self.get(tenant)
+
+    def get(self, tenant):
+        """
+        Returns the filter of a tenant, loading or creating it if it is not resident. The returned instance is
+        detached when the filter is spilled to disk, so it should not be kept across other calls to the pool.\n
+        :param tenant: Any hashable value that identifies the filter.
+        """
+        with self._lock:
+            bloom_filter = self._filters.get(tenant)
+            if bloom_filter is not None:
+                self._filters.move_to_end(tenant)
+                return bloom_filter
+
+            path = self._spilled.pop(tenant, None)
+            if path is not None:
+                bloom_filter = LOCAL_BACKENDS[self._backend].load(path, **self._kwargs)
+                os.remove(path)
+            else:
+                bloom_filter = BloomFilter(self._max_number_of_element_expected, self._error_rate, self._backend,
+                                           **self._kwargs)
+
+            self._filters[tenant] = bloom_filter
+            self._evict()
+            return bloom_filter
+
+    def _spill_path(self, tenant):
+        return os.path.join(self._spill_dir, '{}.npz'.format(hashlib.sha1(repr(tenant).encode()).hexdigest()))
+
+    def _evict(self):
+        # The most recently used filter is always kept, even if it does not fit in the budget alone
+        size = self.resident_size
+        while size > self._memory_budget and len(self._filters) > 1:
+            tenant, bloom_filter = self._filters.popitem(last=False)
+            path = self._spill_path(tenant)
+            with bloom_filter.lock:
+                bloom_filter.dump(path)
+                # Writes through references held by callers would be lost, so they raise from now on
+                bloom_filter.detach('Filter of tenant {!r} has been spilled to disk. Get it from the pool again.'.
+                                    format(tenant))
+            self._spilled[tenant] = path
+            size -= bloom_filter.resident_size
+
+    def add(self, tenant, key):
+        with self._lock:
+            result = self.get(tenant).add(key)
+            self._evict()  # paged filters grow as they take writes
+            return result
+
+    def contains(self, tenant, key):
+        with self._lock:
+            return key in self.get(tenant)
+
+    def _route(self, pairs, operation, write=False):
+        """
+        Groups a list of (tenant, key) pairs by tenant and runs `operation` once per tenant over all its keys.\n
+        :param write: Whether `operation` writes into the filters, so the memory budget is checked again afterwards.
+        :return: Boolean numpy array with the results in the order of `pairs`.
+        """
+        groups = OrderedDict()
+        for position, (tenant, key) in enumerate(pairs):
+            positions, keys = groups.setdefault(tenant, ([], []))
+            positions.append(position)
+            keys.append(key)
+
+        mask = np.zeros(len(pairs), dtype=bool)
+        with self._lock:
+            for tenant, (positions, keys) in groups.items():
+                mask[positions] = operation(self.get(tenant), keys)
+            if write:
+                self._evict()
+        return mask
+
+    def test_and_set_many(self, pairs):
+        """
+        Adds a batch of (tenant, key) pairs.\n
+        :return: Boolean numpy array, True for every pair whose key was not in the filter of its tenant.
+        """
+        return self._route(list(pairs), lambda bloom_filter, keys: bloom_filter.test_and_set_many(keys), write=True)
+
+    def contains_many(self, pairs):
+        """
+        Checks a batch of (tenant, key) pairs.\n
+        :return: Boolean numpy array, True for every pair whose key is in the filter of its tenant.
+        """
+        return self._route(list(pairs), lambda bloom_filter, keys: bloom_filter.contains_many(keys))
+
+    def dedupe(self, pairs, chunk_size=DEDUPE_CHUNK_SIZE):
+        """
+        Same as `BaseBackend.dedupe` for a stream of (tenant, key) pairs.
+        """
+        for chunk in chunked(pairs, chunk_size):
+            for pair, new in zip(chunk, self.test_and_set_many(chunk)):
+                if new:
+                    yield pair
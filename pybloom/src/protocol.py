@@ -0,0 +1,87 @@
+"""
+Binary protocol spoken between `pybloom serve` and `SocketBackend`.
+
+Every message is a frame: a 4 bytes big-endian length followed by the payload. Request payloads are the opcode
+(1 byte), the filter name (2 bytes length + utf-8) and the body of the operation. Response payloads are a status byte
+followed by the body, or by an utf-8 error message if the status is `STATUS_ERROR`.
+
+Bodies of batch operations are a 4 bytes count followed by every key (4 bytes length + bytes). Their responses are
+the capacity of the filter (8 bytes) followed by one byte per key (1 if the key was new / is in the filter).
+"""
+import struct
+
+from pybloom.src import BloomFilterException
+
+OP_INFO = 0
+OP_TEST_AND_SET = 1
+OP_CONTAINS = 2
+OP_RESET = 3
+
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+FRAME_HEADER = struct.Struct('!I')
+NAME_HEADER = struct.Struct('!BH')
+COUNT = struct.Struct('!I')
+CAPACITY = struct.Struct('!Q')
+
+
+def recv_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 2 ** 20))
+        if not chunk:
+            raise ConnectionError('Connection closed by peer')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def send_frame(sock, payload):
+    sock.sendall(FRAME_HEADER.pack(len(payload)) + payload)
+
+
+def recv_frame(sock):
+    size, = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+    return recv_exactly(sock, size)
+
+
+def encode_request(op, name, body=b''):
+    name = name.encode('utf-8')
+    return NAME_HEADER.pack(op, len(name)) + name + body
+
+
+def decode_request(payload):
+    op, name_size = NAME_HEADER.unpack_from(payload)
+    name_end = NAME_HEADER.size + name_size
+    return op, payload[NAME_HEADER.size:name_end].decode('utf-8'), memoryview(payload)[name_end:]
+
+
+def encode_keys(keys):
+    parts = [COUNT.pack(len(keys))]
+    for key in keys:
+        parts.append(COUNT.pack(len(key)))
+        parts.append(key)
+    return b''.join(parts)
+
+
+def decode_keys(body):
+    count, = COUNT.unpack_from(body)
+    position = COUNT.size
+    keys = []
+    for _ in range(count):
+        size, = COUNT.unpack_from(body, position)
+        position += COUNT.size
+        keys.append(bytes(body[position:position + size]))
+        position += size
+    return keys
+
+
+def encode_response(body=b'', status=STATUS_OK):
+    return bytes([status]) + body
+
+
+def decode_response(payload):
+    if payload[0] == STATUS_ERROR:
+        raise BloomFilterException(payload[1:].decode('utf-8'))
+    return payload[1:]
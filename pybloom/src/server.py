@@ -0,0 +1,120 @@
+import argparse
+import json
+import os
+import socketserver
+
+import numpy as np
+
+from pybloom.src import BloomFilterException, log
+from pybloom.src import protocol
+from pybloom.src.bloomfilter import BloomFilter
+from pybloom.src.pool import LOCAL_BACKENDS
+
+
+class FilterRequestHandler(socketserver.BaseRequestHandler):
+    """
+    Serves the requests of a single client connection, in order, until the client closes it.
+    """
+
+    def handle(self):
+        while True:
+            try:
+                payload = protocol.recv_frame(self.request)
+            except ConnectionError:
+                return
+
+            # Any error is sent back to the client, so neither the connection nor the server go down
+            try:
+                response = protocol.encode_response(self.server.dispatch(*protocol.decode_request(payload)))
+            except BloomFilterException as e:
+                response = protocol.encode_response(str(e).encode('utf-8'), protocol.STATUS_ERROR)
+            except Exception as e:
+                log.exception('Error serving a request')
+                response = protocol.encode_response('{}: {}'.format(type(e).__name__, e).encode('utf-8'),
+                                                    protocol.STATUS_ERROR)
+            protocol.send_frame(self.request, response)
+
+
+class FilterServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Hosts local filters and serves them over a Unix domain socket, one thread per client connection.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, filters: dict):
+        self.filters = filters
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        super(FilterServer, self).__init__(socket_path, FilterRequestHandler)
+
+    def dispatch(self, op, name, body):
+        try:
+            bloom_filter = self.filters[name]
+        except KeyError:
+            raise BloomFilterException('Filter {!r} not found.'.format(name))
+
+        if op == protocol.OP_INFO:
+            return json.dumps(dict(array_size=bloom_filter._array_size, hash_size=bloom_filter._optimal_hash,
+                                   filter_size=bloom_filter._filter_size, capacity=len(bloom_filter),
+                                   hash_engine=bloom_filter.hash_engine)).encode('utf-8')
+        elif op == protocol.OP_TEST_AND_SET:
+            mask = bloom_filter.test_and_set_many(protocol.decode_keys(body))
+        elif op == protocol.OP_CONTAINS:
+            mask = bloom_filter.contains_many(protocol.decode_keys(body))
+        elif op == protocol.OP_RESET:
+            bloom_filter.reset()
+            mask = np.zeros(0, dtype=bool)
+        else:
+            raise BloomFilterException('Unknown operation {!r}.'.format(op))
+
+        return protocol.CAPACITY.pack(len(bloom_filter)) + mask.astype(np.uint8).tobytes()
+
+
+def parse_filter(value):
+    """
+    Parses a filter definition of `pybloom serve`: name:max_number_of_element_expected[:error_rate[:backend]].
+    """
+    parts = value.split(':')
+    if not 2 <= len(parts) <= 4:
+        raise argparse.ArgumentTypeError('Filters must be defined as '
+                                         'name:max_number_of_element_expected[:error_rate[:backend]]')
+
+    name, max_number_of_element_expected = parts[0], int(parts[1])
+    error_rate = float(parts[2]) if len(parts) > 2 else .0005
+    backend = parts[3] if len(parts) > 3 else 'numpy'
+    # Filters are hosted by the server process, so shared backends (or the socket backend itself) make no sense
+    if backend not in LOCAL_BACKENDS:
+        raise argparse.ArgumentTypeError('Filters can only use local backends ({}). {!r} found instead.'.
+                                         format(', '.join(sorted(LOCAL_BACKENDS)), backend))
+    return name, max_number_of_element_expected, error_rate, backend
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pybloom')
+    commands = parser.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help='host local filters behind a Unix domain socket')
+    serve.add_argument('--socket', default='/tmp/pybloom.sock', help='path of the Unix domain socket')
+    serve.add_argument('--filter', dest='filters', action='append', type=parse_filter, required=True,
+                       help='name:max_number_of_element_expected[:error_rate[:backend]]. It can be repeated.')
+    serve.add_argument('--hash-engine', default='murmur3', help='hash engine of every filter')
+
+    args = parser.parse_args(argv)
+    if args.command != 'serve':
+        parser.error('a command is required')
+
+    # Clients send every value as bytes, which the vectorized engine cannot hash
+    if args.hash_engine == 'vectorized':
+        parser.error('vectorized hash engine only accepts integers, so it cannot be used by pybloom serve')
+
+    filters = {name: BloomFilter(max_number_of_element_expected, error_rate, backend, hash_engine=args.hash_engine)
+               for name, max_number_of_element_expected, error_rate, backend in args.filters}
+
+    server = FilterServer(args.socket, filters)
+    log.info('Serving filters {} on {!r}'.format(', '.join(sorted(filters)), args.socket))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
@@ -1,19 +1,40 @@
+import asyncio
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
 import unittest
+import zlib
 
+import mmh3
 import redis
-from fakeredis import FakeStrictRedis
-from hamcrest import assert_that, equal_to, raises, is_, instance_of, greater_than, empty, is_not
+from fakeredis import FakeServer, FakeStrictRedis
+from hamcrest import assert_that, equal_to, raises, is_, instance_of, greater_than, empty, is_not, contains_string
 from mock import mock
 from redis import StrictRedis
 from redis.exceptions import LockError
 from redis.lock import LuaLock
 
+from pybloom.src import hashing
+from pybloom.src.backends import ThreadingBackend
 from pybloom.src.backends.bitarraybackend import BitArrayBackend
 from pybloom.src.backends.numpybackend import NumpyBackend
-from pybloom.src.backends.redisbackend import RedisBackend, RedisProxy
+from pybloom.src.backends.pagedbackend import PagedBackend
+from pybloom.src.backends.redisbackend import LUA_ADD_KEY, LUA_ADD_MANY_KEYS, LUA_SET_BITS, PageCache, \
+    RedisBackend, RedisProxy
+from pybloom.src.backends.socketbackend import SocketBackend
 from pybloom.src.bloomfilter import BloomFilter, BloomFilterException, Options, Size, size_to_human_format
+from pybloom.src.countminsketch import LUA_UPDATE_COUNTERS, CountMinSketch, NumpySketch, RedisSketch
+from pybloom.src.delta import HEADER_SIZE, decode_delta
+from pybloom.src.hashing import HASH_ENGINES, get_hash_engine
+from pybloom.src.migration import migrate
+from pybloom.src.pool import LOCAL_BACKENDS, FilterPool
+from pybloom.src.server import FilterServer, main as server_main, parse_filter
 
-LUA_ADD_SCRIPT = """
+# fakeredis has no cjson, so scripts are run with a pure Lua json parser
+LUA_JSON = """
 
     -- https://gist.github.com/tylerneylon/59f4bcf316be525b30ab
     local json = {}
@@ -150,44 +171,34 @@ LUA_ADD_SCRIPT = """
         error('Invalid json syntax starting at ' .. pos_info_str)
       end
     end
+"""
 
-    local capacity = tonumber(redis.call('HGET', KEYS[1], 'capacity'))
-    local filter_size = tonumber(redis.call('HGET', KEYS[1], 'filter_size'))
-    local hash_size = tonumber(redis.call('HGET', KEYS[1], 'hash_size'))
-
-    -- This means that filter has been reset
-    if capacity == nil or filter_size == nil then
-        return false
-    end
-
-    if capacity >= filter_size then
-        return false
-    end
-
-    local sum = 0
-    for i=1, #ARGV do
-        local args = json.parse(ARGV[i])
-        if redis.call('GETBIT', args['key'], args['offset']) == 1 then
-            sum = sum + 1
-        end
 
-        redis.call('SETBIT', args['key'], args['offset'], 1)
-    end
+def with_json(script):
+    return LUA_JSON + script.replace('cjson.decode', 'json.parse')
 
-    -- Only if the element don't exists, increase the capacity (i.e. add it)
-    if sum ~= hash_size then
-        capacity = capacity + 1
-        redis.call('HSET', KEYS[1], 'capacity', capacity)
-    end
 
-    return capacity
-"""
+LUA_ADD_SCRIPT = with_json(LUA_ADD_KEY)
 
 
 class MockRedisProxy(object):
-    def __init__(self, *args, **kwargs):
-        self._connection = mock.patch('pybloom.src.backends.redisbackend.redis.StrictRedis',
-                                      new_callable=FakeStrictRedis).start()
+    # Like the real connection pools, clients are shared by url: fakeredis deadlocks if a connection of a server is
+    # garbage collected while that server is running a command
+    servers = {}  # redis_connection -> FakeServer
+    connections = {}  # (redis_connection, decode_responses) -> FakeStrictRedis
+
+    def __init__(self, redis_connection, retries=3, max_retry_wait=None, decode_responses=True):
+        connection = self.connections.get((redis_connection, decode_responses))
+        if connection is None:
+            server = self.servers.setdefault(redis_connection, FakeServer())
+            connection = self.connections[(redis_connection, decode_responses)] = \
+                FakeStrictRedis(server=server, decode_responses=decode_responses)
+        self._connection = connection
+
+    @classmethod
+    def reset(cls):
+        cls.servers.clear()
+        cls.connections.clear()
 
     def as_pipeline(self):
         return self._connection.pipeline()
@@ -203,15 +214,38 @@ class MockRedisProxy(object):
         pass
 
 
+def mock_redis_backend(redis_connection='redis://localhost/1', **kwargs):
+    with mock.patch('pybloom.src.backends.redisbackend.RedisProxy', new=MockRedisProxy):
+        backend = RedisBackend(redis_connection=redis_connection, **kwargs)
+
+    # Small segments: fakeredis copies the whole string on every SETBIT
+    backend._max_redis_offset_size = 2 ** 16 - 1
+    backend._lua_add = backend._redis.register_script(LUA_ADD_SCRIPT)
+    backend._lua_add_many = backend._redis.register_script(with_json(LUA_ADD_MANY_KEYS))
+    # fakeredis runs a newer Lua than redis, without the bit library but with native bitwise operators
+    backend._lua_set_bits = backend._redis.register_script('local bit = {bor = function(a, b) return a | b end}\n' +
+                                                           LUA_SET_BITS)
+    return backend
+
+
+def mock_redis_sketch(**kwargs):
+    with mock.patch('pybloom.src.countminsketch.RedisProxy', new=MockRedisProxy):
+        sketch = RedisSketch(redis_connection='redis://localhost/1', **kwargs)
+
+    # fakeredis runs a newer Lua than redis, without the global unpack
+    sketch._lua_update = sketch._redis.register_script('local unpack = table.unpack\n' + LUA_UPDATE_COUNTERS)
+    return sketch
+
+
 class testRedisProxy(unittest.TestCase):
     def setUp(self):
-        self._proxy = RedisProxy('')
-        self._proxy._connection = mock.patch('pybloom.src.backends.redisbackend.redis.StrictRedis',
-                                             new_callable=FakeStrictRedis).start()
-        self._proxy._connection.reset = self._proxy._connection.pipeline().reset  # bad signature in mockredis
+        with mock.patch('pybloom.src.backends.redisbackend.get_connection_pool',
+                        return_value=FakeStrictRedis().connection_pool):
+            self._proxy = RedisProxy('')
 
-    @mock.patch('pybloom.src.backends.redisbackend.redis.StrictRedis', spec=StrictRedis)
-    def testRetryConnectionError(self, rediss):
+    @mock.patch('pybloom.src.backends.redisbackend.get_connection_pool')
+    def testRetryConnectionError(self, _):
+        rediss = mock.Mock(spec=StrictRedis)
         rediss.ping.side_effect = redis.exceptions.ConnectionError
 
         r = RedisProxy('', retries=1, max_retry_wait=1)
@@ -220,8 +254,9 @@ class testRedisProxy(unittest.TestCase):
         assert_that(r.ping, raises(redis.exceptions.ConnectionError))
         assert_that(rediss.ping.call_count, equal_to(1))
 
-    @mock.patch('pybloom.src.backends.redisbackend.redis.StrictRedis', spec=StrictRedis)
-    def testRetryTimeoutError(self, rediss):
+    @mock.patch('pybloom.src.backends.redisbackend.get_connection_pool')
+    def testRetryTimeoutError(self, _):
+        rediss = mock.Mock(spec=StrictRedis)
         rediss.ping.side_effect = redis.exceptions.TimeoutError
 
         r = RedisProxy('', retries=1, max_retry_wait=1)
@@ -242,9 +277,45 @@ class testRedisProxy(unittest.TestCase):
 
         assert_that(self._proxy.get('pipeline'), equal_to(b'pipe'))
 
+    @mock.patch.dict('pybloom.src.backends.redisbackend._connection_pools', clear=True)
+    @mock.patch('pybloom.src.backends.redisbackend.redis.ConnectionPool')
+    def testSharedConnectionPool(self, connection_pool):
+        connection_pool.from_url.side_effect = lambda url, decode_responses: mock.Mock()
+
+        first, second = RedisProxy('redis://localhost'), RedisProxy('redis://localhost')
+        assert_that(first._connection.connection_pool, is_(second._connection.connection_pool))
+        assert_that(connection_pool.from_url.call_count, equal_to(1))
+
+        # Raw responses need their own pool
+        raw = RedisProxy('redis://localhost', decode_responses=False)
+        assert_that(raw._connection.connection_pool, is_not(first._connection.connection_pool))
+        assert_that(connection_pool.from_url.call_count, equal_to(2))
+
+    def testCachedWrapper(self):
+        wrapper = self._proxy.get
+        assert_that(self._proxy.get, is_(wrapper))
+        assert_that(self._proxy.__dict__['get'], is_(wrapper))
+
+    def testNestedPipeline(self):
+        with self._proxy.as_pipeline() as outer:
+            outer.set('outer', 'pipe')
+
+            # The pipeline of the thread is in use, so the inner block gets a fresh one
+            with self._proxy.as_pipeline() as inner:
+                assert_that(inner, is_not(outer))
+                inner.set('inner', 'pipe')
+                assert_that(inner.execute(), equal_to([True]))
+
+            assert_that(outer.execute(), equal_to([True]))
+
+        assert_that(self._proxy.as_pipeline(), is_(outer))
+        assert_that(self._proxy.get('outer'), equal_to(b'pipe'))
+        assert_that(self._proxy.get('inner'), equal_to(b'pipe'))
+
 
 class testRedisBackend(unittest.TestCase):
     def setUp(self):
+        MockRedisProxy.reset()
         with mock.patch('pybloom.src.backends.redisbackend.RedisProxy', new=MockRedisProxy):
             self._backend = RedisBackend(array_size=10, hash_size=3, redis_connection='', filter_size=5)
             self._backend._lua_add = self._backend._redis.register_script(LUA_ADD_SCRIPT)
@@ -275,17 +346,17 @@ class testRedisBackend(unittest.TestCase):
     # @mock.patch('pybloom.src.backends.redisbackend.lock', spec=LuaLock)
     def testMetadataOk(self):
         # Check we dont have any metadata yet
-        response = {key.decode(): val.decode() for key, val in
-                    self._backend._redis.hgetall(self._backend._metadata_key).items()}
-        assert_that(response, equal_to(dict(array_size='10', hash_size='3', filter_size='5', capacity='0')))
+        response = self._backend._redis.hgetall(self._backend._metadata_key)
+        assert_that(response, equal_to(dict(array_size='10', hash_size='3', filter_size='5', capacity='0',
+                                            hash_engine='murmur3')))
 
         # Add data
         self._backend.add(4)
 
         # Check metadata again
-        response = {key.decode(): val.decode() for key, val in
-                    self._backend._redis.hgetall(self._backend._metadata_key).items()}
-        assert_that(response, equal_to(dict(array_size='10', hash_size='3', filter_size='5', capacity='1')))
+        response = self._backend._redis.hgetall(self._backend._metadata_key)
+        assert_that(response, equal_to(dict(array_size='10', hash_size='3', filter_size='5', capacity='1',
+                                            hash_engine='murmur3')))
 
     def testResetWithData(self):
         self._backend.add(45)
@@ -294,8 +365,19 @@ class testRedisBackend(unittest.TestCase):
         self._backend.reset()
         assert_that(list(self._backend._redis.scan_iter('bloom_filter:*')), is_(empty()))
         assert_that(len(self._backend), is_(0))
-        response = self._backend._redis.hgetall(self._backend._metadata_key).items()
-        assert_that(response, is_(empty()))
+
+        # Metadata is kept, so the filter is still usable by every client
+        response = self._backend._redis.hgetall(self._backend._metadata_key)
+        assert_that(response['capacity'], equal_to('0'))
+        assert_that(response['generation'], equal_to('1'))
+
+        self._backend.reset()
+        response = self._backend._redis.hget(self._backend._metadata_key, 'generation')
+        assert_that(response, equal_to('2'))
+
+        self._backend.add(45)
+        assert_that(45 in self._backend, is_(True))
+        assert_that(len(self._backend), is_(1))
 
     def testAddandCheck(self):
         self._backend.add('house')
@@ -304,6 +386,72 @@ class testRedisBackend(unittest.TestCase):
         self._backend += 'horse'
         assert_that('horse' in self._backend, is_(True))
 
+    def testDedupe(self):
+        backend = mock_redis_backend(array_size=1000, hash_size=3, filter_size=5)
+        assert_that(list(backend.dedupe(['a', 'b', 'a', 'c', 'b'], chunk_size=4)), equal_to(['a', 'b', 'c']))
+        assert_that(len(backend), equal_to(3))
+
+        # A chunk that does not fit in the filter is not applied
+        with self.assertRaises(BloomFilterException):
+            list(backend.dedupe(['d', 'e', 'f']))
+        assert_that(len(backend), equal_to(3))
+        assert_that('d' in backend, is_(False))
+
+    def testTestAndSet(self):
+        backend = mock_redis_backend(array_size=1000, hash_size=3, filter_size=10)
+
+        assert_that(backend.test_and_set('house'), is_(True))
+        assert_that(backend.test_and_set('house'), is_(False))
+        assert_that('house' in backend, is_(True))
+        assert_that(len(backend), equal_to(1))
+
+    def testTestAndSetMany(self):
+        backend = mock_redis_backend(array_size=1000, hash_size=3, filter_size=10)
+
+        # Duplicates inside a batch behave as if they were added one after another
+        assert_that(list(backend.test_and_set_many(['a', 'b', 'a'])), equal_to([True, True, False]))
+        assert_that(list(backend.test_and_set_many(['a', 'c'])), equal_to([False, True]))
+        assert_that(list(backend.test_and_set_many([])), equal_to([]))
+        assert_that(len(backend), equal_to(3))
+
+    def testCachedContains(self):
+        backend = mock_redis_backend(array_size=1000, hash_size=3, filter_size=10, cache_size=2 ** 20,
+                                     cache_page_size=64)
+        other = mock_redis_backend(array_size=1000, hash_size=3, filter_size=10)
+        assert_that('house' in backend, is_(False))
+
+        # Cached zero bits are re-checked with GETBIT, without fetching their pages again
+        other.add('house')
+        with mock.patch.object(PageCache, 'put') as put:
+            assert_that('house' in backend, is_(True))
+            assert_that(put.called, is_(False))
+
+        # Own writes are applied to the cached pages
+        backend.add('horse')
+        assert_that([value in backend for value in ['horse', 'house', 'car']], equal_to([True, True, False]))
+
+    def testCachedContainsNotStrict(self):
+        backend = mock_redis_backend(array_size=1000, hash_size=3, filter_size=10, cache_size=2 ** 20,
+                                     cache_page_size=64, cache_strict=False)
+        other = mock_redis_backend(array_size=1000, hash_size=3, filter_size=10)
+        assert_that('house' in backend, is_(False))
+
+        # Cached negatives are trusted until their pages expire
+        other.add('house')
+        assert_that('house' in backend, is_(False))
+
+        backend._cache.clear()
+        assert_that('house' in backend, is_(True))
+
+    def testWrongHashEngine(self):
+        mock_redis_backend(array_size=1000, hash_size=3, filter_size=10, hash_engine='murmur3-128')
+
+        with self.assertRaises(BloomFilterException) as cm:
+            mock_redis_backend(array_size=1000, hash_size=3, filter_size=10)
+
+        assert_that(str(cm.exception), equal_to("Filter 'bloom_filter' was built with 'murmur3-128' hash engine, but "
+                                                "'murmur3' was requested."))
+
 
 class testNumpyBackend(unittest.TestCase):
     def setUp(self):
@@ -329,6 +477,61 @@ class testNumpyBackend(unittest.TestCase):
 
         assert_that(len(self._backend), equal_to(2))
 
+    def testDedupe(self):
+        backend = NumpyBackend(array_size=1000, hash_size=3, filter_size=10)
+
+        # Duplicates inside a chunk and across chunks are yielded once, in order of first appearance
+        assert_that(list(backend.dedupe(['a', 'b', 'a', 'c', 'b', 'd'], chunk_size=4)),
+                    equal_to(['a', 'b', 'c', 'd']))
+        assert_that(len(backend), equal_to(4))
+
+        assert_that(list(backend.dedupe(['d', 'e', 'e'])), equal_to(['e']))
+        assert_that(len(backend), equal_to(5))
+
+    def testDedupeFilterFull(self):
+        backend = NumpyBackend(array_size=1000, hash_size=3, filter_size=3)
+
+        # Duplicates don't take room in the filter
+        assert_that(list(backend.dedupe(['a', 'a', 'a', 'b'])), equal_to(['a', 'b']))
+
+        with self.assertRaises(BloomFilterException) as cm:
+            list(backend.dedupe(['c', 'd']))
+
+        assert_that(str(cm.exception), equal_to('Filter is full'))
+        # A chunk that does not fit in the filter is not applied
+        assert_that(len(backend), equal_to(2))
+        assert_that('c' in backend, is_(False))
+
+    def testAsyncDedupe(self):
+        backend = NumpyBackend(array_size=1000, hash_size=3, filter_size=10)
+
+        async def values():
+            for value in ['a', 'b', 'a', 'c']:
+                yield value
+
+        async def collect(iterable):
+            return [item async for item in backend.adedupe(iterable, chunk_size=2)]
+
+        assert_that(asyncio.run(collect(values())), equal_to(['a', 'b', 'c']))
+        assert_that(asyncio.run(collect(['c', 'd'])), equal_to(['d']))
+
+    def testTestAndSet(self):
+        backend = NumpyBackend(array_size=1000, hash_size=3, filter_size=10)
+
+        assert_that(backend.test_and_set('house'), is_(True))
+        assert_that(backend.test_and_set('house'), is_(False))
+        assert_that('house' in backend, is_(True))
+        assert_that(len(backend), equal_to(1))
+
+    def testTestAndSetMany(self):
+        backend = NumpyBackend(array_size=1000, hash_size=3, filter_size=10)
+
+        # Duplicates inside a batch behave as if they were added one after another
+        assert_that(list(backend.test_and_set_many(['a', 'b', 'a'])), equal_to([True, True, False]))
+        assert_that(list(backend.test_and_set_many(['a', 'c'])), equal_to([False, True]))
+        assert_that(list(backend.test_and_set_many([])), equal_to([]))
+        assert_that(len(backend), equal_to(3))
+
 
 class testBitArrayBackend(unittest.TestCase):
     def setUp(self):
@@ -354,6 +557,48 @@ class testBitArrayBackend(unittest.TestCase):
 
         assert_that(len(self._backend), equal_to(2))
 
+    def testDedupe(self):
+        backend = BitArrayBackend(array_size=1000, hash_size=3, filter_size=10)
+
+        # Duplicates inside a chunk and across chunks are yielded once, in order of first appearance
+        assert_that(list(backend.dedupe(['a', 'b', 'a', 'c', 'b', 'd'], chunk_size=4)),
+                    equal_to(['a', 'b', 'c', 'd']))
+        assert_that(len(backend), equal_to(4))
+
+        assert_that(list(backend.dedupe(['d', 'e', 'e'])), equal_to(['e']))
+        assert_that(len(backend), equal_to(5))
+
+    def testDedupeFilterFull(self):
+        backend = BitArrayBackend(array_size=1000, hash_size=3, filter_size=3)
+
+        # Duplicates don't take room in the filter
+        assert_that(list(backend.dedupe(['a', 'a', 'a', 'b'])), equal_to(['a', 'b']))
+
+        with self.assertRaises(BloomFilterException) as cm:
+            list(backend.dedupe(['c', 'd']))
+
+        assert_that(str(cm.exception), equal_to('Filter is full'))
+        # A chunk that does not fit in the filter is not applied
+        assert_that(len(backend), equal_to(2))
+        assert_that('c' in backend, is_(False))
+
+    def testTestAndSet(self):
+        backend = BitArrayBackend(array_size=1000, hash_size=3, filter_size=10)
+
+        assert_that(backend.test_and_set('house'), is_(True))
+        assert_that(backend.test_and_set('house'), is_(False))
+        assert_that('house' in backend, is_(True))
+        assert_that(len(backend), equal_to(1))
+
+    def testTestAndSetMany(self):
+        backend = BitArrayBackend(array_size=1000, hash_size=3, filter_size=10)
+
+        # Duplicates inside a batch behave as if they were added one after another
+        assert_that(list(backend.test_and_set_many(['a', 'b', 'a'])), equal_to([True, True, False]))
+        assert_that(list(backend.test_and_set_many(['a', 'c'])), equal_to([False, True]))
+        assert_that(list(backend.test_and_set_many([])), equal_to([]))
+        assert_that(len(backend), equal_to(3))
+
 
 class testBloomFilter(unittest.TestCase):
     def testBadNumberofElements(self):
@@ -428,3 +673,538 @@ class testBloomFilter(unittest.TestCase):
     def testSizeUnits(self):
         assert_that(size_to_human_format(1024), equal_to(Size(size=1.0, unit='KB')))
         assert_that(size_to_human_format(2 ** 32, unit='GB'), equal_to(Size(size=4.0, unit='GB')))
+
+
+class testHashEngines(unittest.TestCase):
+    def testMurmur3Compatibility(self):
+        backend = NumpyBackend(array_size=1000, hash_size=5, filter_size=10)
+
+        # Same indexes as the mmh3.hash loop of previous versions
+        for value in ['house', 'cami\u00f3n', b'horse', 45, 4.5]:
+            hashable = value if isinstance(value, (bytes, str)) else str(value)
+            expected = [mmh3.hash(hashable, i, signed=False) % 1000 for i in range(5)]
+            assert_that(list(backend._filter_it(value)), equal_to(expected))
+
+    def testDigestMany(self):
+        values = [0, 1, 45, 2 ** 40]
+        for name in sorted(HASH_ENGINES):
+            if name == 'xxh3' and hashing.xxhash is None:
+                continue
+
+            engine = get_hash_engine(name)
+            digests = engine.digest_many(values, 4)
+            assert_that(digests.shape, equal_to((4, 4)))
+            for value, row in zip(values, digests):
+                assert_that(list(row), equal_to(list(engine.digest(value, 4))))
+
+            # Hashes are prefix-consistent
+            assert_that(list(engine.digest(45, 2)), equal_to(list(digests[2][:2])))
+
+    def testVectorizedOnlyIntegers(self):
+        backend = NumpyBackend(array_size=1000, hash_size=3, filter_size=10, hash_engine='vectorized')
+        assert_that(list(backend.test_and_set_many([1, 2, 1])), equal_to([True, True, False]))
+
+        with self.assertRaises(BloomFilterException) as cm:
+            backend.add('house')
+
+        assert_that(str(cm.exception), equal_to("'vectorized' hash engine only accepts integer values."))
+
+    def testHashEngineNotFound(self):
+        with self.assertRaises(BloomFilterException) as cm:
+            BloomFilter(100, hash_engine='md5')
+
+        assert_that(str(cm.exception), equal_to("Hash engine 'md5' not found. Available engines: murmur3, "
+                                                "murmur3-128, vectorized, xxh3."))
+
+
+class testPagedBackend(unittest.TestCase):
+    def setUp(self):
+        self._backend = PagedBackend(array_size=10000, hash_size=3, filter_size=100, page_size=16)
+
+    def testLazyPages(self):
+        assert_that(self._backend.resident_size, equal_to(0))
+
+        self._backend.add('house')
+        assert_that(self._backend.resident_size, greater_than(0))
+        assert_that(self._backend.resident_size, is_not(greater_than(3 * 16)))
+
+        self._backend.reset()
+        assert_that(self._backend.resident_size, equal_to(0))
+        assert_that('house' in self._backend, is_(False))
+
+    def testAddandCheck(self):
+        self._backend.add('house')
+        assert_that('house' in self._backend, is_(True))
+
+        self._backend += 'horse'
+        assert_that('horse' in self._backend, is_(True))
+
+        assert_that(len(self._backend), equal_to(2))
+
+    def testManyPages(self):
+        values = ['value-{}'.format(i) for i in range(50)]
+        assert_that(list(self._backend.test_and_set_many(values + values[:5])), equal_to([True] * 50 + [False] * 5))
+
+        # Bits of every page are read back in the order of the values
+        others = ['other-{}'.format(i) for i in range(50)]
+        expected = [value in self._backend for value in values + others]
+        assert_that(list(self._backend.contains_many(values + others)), equal_to(expected))
+        assert_that(all(expected[:50]), is_(True))
+
+
+class testDump(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+
+    def testDumpLoad(self):
+        values = ['value-{}'.format(i) for i in range(20)]
+        for name, backend_class in sorted(LOCAL_BACKENDS.items()):
+            path = os.path.join(self._dir, '{}.npz'.format(name))
+            backend = backend_class(array_size=2 ** 20 + 3, hash_size=3, filter_size=100, hash_engine='murmur3-128')
+            backend.test_and_set_many(values)
+            backend.dump(path)
+
+            loaded = backend_class.load(path)
+            assert_that(loaded, instance_of(backend_class))
+            assert_that(loaded.hash_engine, equal_to('murmur3-128'))
+            assert_that(len(loaded), equal_to(20))
+            assert_that(all(loaded.contains_many(values)), is_(True))
+            assert_that(list(loaded.contains_many(['house', 'horse'])),
+                        equal_to(list(backend.contains_many(['house', 'horse']))))
+
+    def testLoadWrongHashEngine(self):
+        path = os.path.join(self._dir, 'filter.npz')
+        NumpyBackend(array_size=1000, hash_size=3, filter_size=10).dump(path)
+
+        # Same hash engine is accepted
+        assert_that(NumpyBackend.load(path, hash_engine='murmur3').hash_engine, equal_to('murmur3'))
+
+        with self.assertRaises(BloomFilterException) as cm:
+            NumpyBackend.load(path, hash_engine='xxh3')
+
+        assert_that(str(cm.exception), equal_to("Filter {!r} was dumped with 'murmur3' hash engine, but 'xxh3' was "
+                                                "requested.".format(path)))
+
+
+class testFilterPool(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+
+        # Budget only fits the most recently used filter
+        self._pool = FilterPool(100, memory_budget=1, spill_dir=self._dir, hash_engine='murmur3-128')
+
+    def testSpill(self):
+        self._pool.add('t1', 'house')
+        self._pool.add('t2', 'horse')
+        assert_that(len(self._pool), equal_to(2))
+        assert_that(os.listdir(self._dir), is_not(empty()))
+
+        # Spilled filters are loaded back with the arguments of the pool
+        assert_that(self._pool.contains('t1', 'house'), is_(True))
+        assert_that(self._pool.contains('t1', 'horse'), is_(False))
+        assert_that(self._pool['t1'].hash_engine, equal_to('murmur3-128'))
+        assert_that(self._pool.contains('t2', 'horse'), is_(True))
+
+    def testSpilledReference(self):
+        bloom_filter = self._pool['t1']
+        self._pool['t2']
+
+        with self.assertRaises(BloomFilterException) as cm:
+            bloom_filter.add('lost')
+
+        assert_that(str(cm.exception), equal_to("Filter of tenant 't1' has been spilled to disk. Get it from the pool "
+                                                "again."))
+        assert_that(self._pool.contains('t1', 'lost'), is_(False))
+
+        self._pool['t1'].add('kept')
+        assert_that(self._pool.contains('t1', 'kept'), is_(True))
+
+    def testBatches(self):
+        pairs = [('t1', 'a'), ('t2', 'a'), ('t1', 'a'), ('t1', 'b')]
+        assert_that(list(self._pool.test_and_set_many(pairs)), equal_to([True, True, False, True]))
+        assert_that(list(self._pool.contains_many([('t2', 'b'), ('t1', 'b')])), equal_to([False, True]))
+        assert_that(list(self._pool.dedupe([('t2', 'b'), ('t2', 'a'), ('t3', 'a')], chunk_size=2)),
+                    equal_to([('t2', 'b'), ('t3', 'a')]))
+
+    def testSpillAfterWrites(self):
+        writes = [lambda pool: pool.add('t2', 'house'),
+                  lambda pool: pool.test_and_set_many([('t2', 'house')])]
+        for write in writes:
+            spill_dir = tempfile.mkdtemp(dir=self._dir)
+            # Empty paged filters do not allocate any page, so they fit in the budget until they take writes
+            pool = FilterPool(100000, backend='paged', memory_budget=1000, spill_dir=spill_dir)
+            pool['t1']
+            pool['t2']
+            assert_that(os.listdir(spill_dir), empty())
+
+            write(pool)
+            assert_that(len(os.listdir(spill_dir)), equal_to(1))
+            assert_that(pool.contains('t2', 'house'), is_(True))
+
+    def testNotLocalBackend(self):
+        with self.assertRaises(BloomFilterException) as cm:
+            FilterPool(100, backend='redis')
+
+        assert_that(str(cm.exception), equal_to("FilterPool only works with local backends (bitarray, numpy, paged). "
+                                                "'redis' found instead."))
+
+
+class testCountMinSketch(unittest.TestCase):
+    def setUp(self):
+        MockRedisProxy.reset()
+
+    def sketches(self, width=1000, depth=3, **kwargs):
+        for conservative in (True, False):
+            yield NumpySketch(width, depth, conservative=conservative, **kwargs)
+            MockRedisProxy.reset()
+            yield mock_redis_sketch(width=width, depth=depth, conservative=conservative, **kwargs)
+
+    def testUpdate(self):
+        for sketch in self.sketches():
+            assert_that(sketch.update('house'), equal_to(1))
+            assert_that(sketch.update('house', 4), equal_to(5))
+            assert_that(sketch['house'], equal_to(5))
+            assert_that(sketch.query('horse'), equal_to(0))
+
+    def testUpdateMany(self):
+        for sketch in self.sketches():
+            # Values of a batch are counted one after another
+            assert_that(list(sketch.update_many(['a', 'a', 'a'])), equal_to([1, 2, 3]))
+            assert_that(list(sketch.update_many(['a', 'b', 'a'], [2, 5, 1])), equal_to([5, 5, 6]))
+            assert_that(list(sketch.query_many(['a', 'b', 'c'])), equal_to([6, 5, 0]))
+            assert_that(list(sketch.update_many([])), equal_to([]))
+
+    def testSameEstimates(self):
+        # Tiny sketches, so counters are shared by several values
+        values = ['value-{}'.format(i % 30) for i in range(100)]
+        for conservative in (True, False):
+            MockRedisProxy.reset()
+            numpy_sketch = NumpySketch(8, 2, conservative=conservative)
+            redis_sketch = mock_redis_sketch(width=8, depth=2, conservative=conservative)
+
+            assert_that(list(numpy_sketch.update_many(values)), equal_to(list(redis_sketch.update_many(values))))
+            assert_that(list(numpy_sketch.query_many(values)), equal_to(list(redis_sketch.query_many(values))))
+
+    def testSaturation(self):
+        sketch = NumpySketch(10, 2, dtype='uint16', conservative=False)
+        assert_that(sketch.update('house', 2 ** 16 + 10), equal_to(2 ** 16 - 1))
+        assert_that(list(sketch.update_many(['house', 'house'])), equal_to([2 ** 16 - 1] * 2))
+
+    def testNegativeCounts(self):
+        bloom_filter = NumpyBackend(array_size=1000, hash_size=3, filter_size=10)
+        for sketch in self.sketches():
+            sketch.update('house', 2)
+            with self.assertRaises(BloomFilterException) as cm:
+                sketch.update('house', -1)
+
+            assert_that(str(cm.exception), equal_to('Counts must be non-negative. -1 found instead.'))
+
+            for operation in (lambda: sketch.update_many(['house', 'horse'], [1, -3]),
+                              lambda: sketch.update_many(['house'], -2),
+                              lambda: sketch.observe_many(['horse', 'house'], bloom_filter, [1, -3])):
+                with self.assertRaises(BloomFilterException):
+                    operation()
+
+            # Nothing is counted by a rejected batch
+            assert_that(list(sketch.query_many(['house', 'horse'])), equal_to([2, 0]))
+            assert_that('horse' in bloom_filter, is_(False))
+
+    def testReset(self):
+        for sketch in self.sketches():
+            sketch.update('house', 3)
+            sketch.reset()
+            assert_that(sketch['house'], equal_to(0))
+            assert_that(sketch.update('house'), equal_to(1))
+
+    def testRedisMetadata(self):
+        mock_redis_sketch(width=1000, depth=3)
+        assert_that(mock_redis_sketch(width=1000, depth=3).width, equal_to(1000))
+
+        with self.assertRaises(BloomFilterException) as cm:
+            mock_redis_sketch(width=1000, depth=4)
+
+        assert_that(str(cm.exception), equal_to("Sketch 'count_min_sketch' was built with 1000 columns, 3 rows and "
+                                                "'murmur3' hash engine, but 1000 columns, 4 rows and 'murmur3' hash "
+                                                "engine were requested."))
+
+        with self.assertRaises(BloomFilterException):
+            mock_redis_sketch(width=1000, depth=3, hash_engine='murmur3-128')
+
+    def testObserve(self):
+        bloom_filter = NumpyBackend(array_size=1000, hash_size=5, filter_size=10)
+        sketch = NumpySketch(1000, 3)
+
+        assert_that(sketch.observe('house', bloom_filter), equal_to((True, 1)))
+        assert_that(sketch.observe('house', bloom_filter), equal_to((False, 2)))
+        assert_that('house' in bloom_filter, is_(True))
+
+        with self.assertRaises(BloomFilterException):
+            NumpySketch(1000, 3, hash_engine='murmur3-128').observe('house', bloom_filter)
+
+    def testOptimalSize(self):
+        sketch = CountMinSketch(error_rate=.01, confidence=.99)
+        assert_that(sketch, instance_of(NumpySketch))
+        assert_that((sketch.width, sketch.depth), equal_to((272, 5)))
+
+        with self.assertRaises(BloomFilterException) as cm:
+            CountMinSketch(error_rate=2)
+
+        assert_that(str(cm.exception), equal_to('Error rate must be in range (0, 1). 2 found instead.'))
+
+
+class testFilterServer(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self._dir)
+
+        self._socket_path = os.path.join(self._dir, 'pybloom.sock')
+        self._filters = dict(default=NumpyBackend(array_size=1000, hash_size=3, filter_size=5))
+        self._server = FilterServer(self._socket_path, self._filters)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.addCleanup(self._server.server_close)
+        self.addCleanup(self._server.shutdown)
+
+        self._backend = SocketBackend(array_size=10, hash_size=1, filter_size=1, socket_path=self._socket_path)
+        self.addCleanup(self._backend.close)
+
+    def testMetadata(self):
+        # Metadata of the server wins
+        assert_that((self._backend._array_size, self._backend._optimal_hash, self._backend._filter_size),
+                    equal_to((1000, 3, 5)))
+        assert_that(self._backend.hash_engine, equal_to('murmur3'))
+
+    def testAddandCheck(self):
+        self._backend.add('house')
+        assert_that('house' in self._backend, is_(True))
+        assert_that('horse' in self._backend, is_(False))
+        assert_that(self._backend.test_and_set('house'), is_(False))
+        assert_that(len(self._backend), equal_to(1))
+
+        # Values are hashed by the server
+        assert_that('house' in self._filters['default'], is_(True))
+
+    def testDedupe(self):
+        assert_that(list(self._backend.dedupe(['a', 'b', 'a', 'c'], chunk_size=2)), equal_to(['a', 'b', 'c']))
+        assert_that(list(self._backend.contains_many(['a', 'd'])), equal_to([True, False]))
+        assert_that(len(self._backend), equal_to(3))
+
+        with self.assertRaises(BloomFilterException) as cm:
+            list(self._backend.dedupe(['d', 'e', 'f']))
+
+        assert_that(str(cm.exception), equal_to('Filter is full'))
+
+    def testReset(self):
+        self._backend.add('house')
+        self._backend.reset()
+        assert_that(len(self._backend), equal_to(0))
+        assert_that('house' in self._backend, is_(False))
+
+        self._backend.add('house')
+        assert_that('house' in self._backend, is_(True))
+
+    def testErrors(self):
+        with self.assertRaises(BloomFilterException) as cm:
+            SocketBackend(array_size=10, hash_size=1, filter_size=1, socket_path=self._socket_path, name='missing')
+
+        assert_that(str(cm.exception), equal_to("Filter 'missing' not found."))
+
+        # Unexpected errors are sent back too, and the connection keeps working
+        with mock.patch.object(self._filters['default'], 'contains_many', side_effect=ValueError('boom')):
+            with self.assertRaises(BloomFilterException) as cm:
+                'house' in self._backend
+
+        assert_that(str(cm.exception), equal_to('ValueError: boom'))
+        assert_that('house' in self._backend, is_(False))
+
+    def testVectorizedNotServed(self):
+        with self.assertRaises(SystemExit):
+            server_main(['serve', '--socket', self._socket_path, '--filter', 'numbers:100',
+                         '--hash-engine', 'vectorized'])
+
+    def testOnlyLocalBackends(self):
+        assert_that(parse_filter('numbers:100:0.01:paged'), equal_to(('numbers', 100, .01, 'paged')))
+
+        with mock.patch('sys.stderr', new_callable=io.StringIO) as stderr:
+            with self.assertRaises(SystemExit):
+                server_main(['serve', '--socket', self._socket_path, '--filter', 'numbers:100:0.01:redis'])
+
+        assert_that(stderr.getvalue(), contains_string("Filters can only use local backends (bitarray, numpy, paged). "
+                                                       "'redis' found instead."))
+
+
+class testDelta(unittest.TestCase):
+    def testChaining(self):
+        for name, backend_class in sorted(LOCAL_BACKENDS.items()):
+            source = backend_class(array_size=2 ** 16 + 5, hash_size=3, filter_size=100)
+            replica = backend_class(array_size=2 ** 16 + 5, hash_size=3, filter_size=100)
+
+            source.test_and_set_many(['a', 'b'])
+            delta, since = source.export_delta()
+            replica.apply_delta(delta)
+            assert_that(list(replica.contains_many(['a', 'b', 'c'])), equal_to([True, True, False]))
+            assert_that(len(replica), equal_to(2))
+
+            # Next delta only carries the pages written since the previous one
+            source.add('c')
+            delta, since = source.export_delta(since)
+            assert_that(len(decode_delta(delta)[0]['pages']), is_not(greater_than(3)))
+            replica.apply_delta(delta)
+            assert_that(list(replica.contains_many(['a', 'b', 'c'])), equal_to([True, True, True]))
+            assert_that(len(replica), equal_to(3))
+
+            delta, _ = source.export_delta(since)
+            assert_that(decode_delta(delta)[0]['pages'], is_(empty()))
+
+    def testApplyToRedis(self):
+        MockRedisProxy.reset()
+        source = NumpyBackend(array_size=2 ** 16 + 5, hash_size=3, filter_size=100)
+        replica = mock_redis_backend(array_size=2 ** 16 + 5, hash_size=3, filter_size=100)
+
+        source.test_and_set_many(['a', 'b'])
+        replica.apply_delta(source.export_delta()[0])
+        assert_that(list(replica.contains_many(['a', 'b', 'c'])), equal_to([True, True, False]))
+        assert_that(len(replica), equal_to(2))
+
+    def testWrongDelta(self):
+        source = NumpyBackend(array_size=1000, hash_size=3, filter_size=10)
+        replica = NumpyBackend(array_size=1000, hash_size=4, filter_size=10)
+
+        with self.assertRaises(BloomFilterException) as cm:
+            replica.apply_delta(source.export_delta()[0])
+
+        assert_that(str(cm.exception), equal_to("Delta of a filter with 1000 bits, 3 hashes and 'murmur3' hash engine "
+                                                "cannot be applied to a filter with 1000 bits, 4 hashes and 'murmur3' "
+                                                "hash engine."))
+
+        with self.assertRaises(BloomFilterException) as cm:
+            replica.apply_delta(b'not a delta')
+
+        assert_that(str(cm.exception), equal_to('Invalid delta.'))
+
+        # Truncated data and headers without pages are rejected too
+        source.add('house')
+        data = zlib.decompress(source.export_delta()[0])
+        header_size = HEADER_SIZE.size + HEADER_SIZE.unpack_from(data)[0]
+        header = json.dumps(dict(array_size=1000, hash_size=4, hash_engine='murmur3', capacity=1)).encode('utf-8')
+        for delta in (data[:-1], HEADER_SIZE.pack(len(header)) + header + data[header_size:]):
+            with self.assertRaises(BloomFilterException) as cm:
+                replica.apply_delta(zlib.compress(delta))
+
+            assert_that(str(cm.exception), equal_to('Invalid delta.'))
+
+
+class testFold(unittest.TestCase):
+    def testFold(self):
+        values = ['value-{}'.format(i) for i in range(50)]
+        for name, backend_class in sorted(LOCAL_BACKENDS.items()):
+            backend = backend_class(array_size=12000, hash_size=3, filter_size=100)
+            backend.test_and_set_many(values)
+
+            # Every member is kept
+            assert_that(backend.fold(), is_(backend))
+            assert_that(backend._array_size, equal_to(6000))
+            assert_that(all(backend.contains_many(values)), is_(True))
+
+            backend.fold(3)
+            assert_that(backend._array_size, equal_to(2000))
+            assert_that(all(backend.contains_many(values)), is_(True))
+            assert_that(len(backend), equal_to(50))
+
+            # New values are hashed into the folded filter
+            backend.add('house')
+            assert_that('house' in backend, is_(True))
+
+    def testStaleIndexes(self):
+        values = ['value-{}'.format(i) for i in range(50)]
+        for name, backend_class in sorted(LOCAL_BACKENDS.items()):
+            backend = backend_class(array_size=12000, hash_size=3, filter_size=100)
+
+            # Indexes hashed before a concurrent fold are reduced to the new size
+            indexes = backend._filter_many(values)
+            backend.fold(4)
+            assert_that(all(backend._test_and_set_indexes(indexes)), is_(True))
+            assert_that(all(backend.contains_many(values)), is_(True))
+            assert_that(len(backend), equal_to(50))
+
+    def testDeltaAfterFold(self):
+        values = ['value-{}'.format(i) for i in range(50)]
+        for name, backend_class in sorted(LOCAL_BACKENDS.items()):
+            source = backend_class(array_size=2 ** 18, hash_size=3, filter_size=100)
+            source.test_and_set_many(values)
+            _, since = source.export_delta()
+            source.fold(2)
+
+            # Folded bits are exported both to new replicas and to the ones that were up to date
+            for epoch in (0, since):
+                replica = backend_class(array_size=2 ** 18, hash_size=3, filter_size=100).fold(2)
+                replica.apply_delta(source.export_delta(epoch)[0])
+                assert_that(all(replica.contains_many(values)), is_(True))
+                assert_that(replica._read_bits(0, 2 ** 17).tolist(), equal_to(source._read_bits(0, 2 ** 17).tolist()))
+
+    def testWrongFactor(self):
+        backend = NumpyBackend(array_size=1000, hash_size=3, filter_size=10)
+        for factor in (1, 3, 2.0):
+            with self.assertRaises(BloomFilterException) as cm:
+                backend.fold(factor)
+
+            assert_that(str(cm.exception), equal_to('Filter of 1000 bits cannot be folded by {!r}. Factor must be an '
+                                                    'integer >= 2 that divides the size of the filter.'.format(factor)))
+
+
+class testMigrate(unittest.TestCase):
+    def setUp(self):
+        MockRedisProxy.reset()
+        self._values = ['value-{}'.format(i) for i in range(200)]
+
+        # 4 delta pages, over 3 segment keys of redis
+        self._size = ThreadingBackend.DELTA_PAGE_SIZE * 8 * 4
+
+    def testRoundTrip(self):
+        src = NumpyBackend(array_size=self._size, hash_size=3, filter_size=1000)
+        src.test_and_set_many(self._values)
+        shared = mock_redis_backend(array_size=self._size, hash_size=3, filter_size=1000)
+
+        assert_that(migrate(src, shared, chunk_size=2 ** 12 + 7), is_(shared))
+        assert_that(all(shared.contains_many(self._values)), is_(True))
+        assert_that(len(shared), equal_to(200))
+
+        dst = migrate(shared, BitArrayBackend(array_size=self._size, hash_size=3, filter_size=1000))
+        assert_that(all(dst.contains_many(self._values)), is_(True))
+        assert_that(len(dst), equal_to(200))
+        assert_that(list(dst._read_bits(0, self._size)), equal_to(list(src._read_bits(0, self._size))))
+
+    def testRedisPages(self):
+        src = NumpyBackend(array_size=self._size, hash_size=3, filter_size=1000)
+        src.test_and_set_many(self._values)
+        dst = mock_redis_backend(array_size=self._size, hash_size=3, filter_size=1000)
+
+        # A whole chunk is set with one script call per page
+        with mock.patch.object(dst, '_lua_set_bits', wraps=dst._lua_set_bits) as set_bits:
+            migrate(src, dst)
+        assert_that(set_bits.call_count, equal_to(4 + 1))  # and one more for the capacity
+        assert_that(all(dst.contains_many(self._values)), is_(True))
+
+    def testRedisKeepsBits(self):
+        src = NumpyBackend(array_size=self._size, hash_size=3, filter_size=1000)
+        src.test_and_set_many(self._values[:100])
+        dst = mock_redis_backend(array_size=self._size, hash_size=3, filter_size=1000, cache_size=2 ** 20,
+                                 cache_strict=False)
+        dst.test_and_set_many(self._values[100:])
+        assert_that(any(dst.contains_many(self._values[:100])), is_(False))
+
+        # Pages are OR-ed into the bits already set, and into the cached pages, whose negatives are trusted
+        migrate(src, dst)
+        assert_that(all(dst.contains_many(self._values)), is_(True))
+        dst._cache.clear()
+        assert_that(all(dst.contains_many(self._values)), is_(True))
+
+    def testWrongFilters(self):
+        src = NumpyBackend(array_size=1000, hash_size=3, filter_size=10)
+
+        with self.assertRaises(BloomFilterException) as cm:
+            migrate(src, NumpyBackend(array_size=1000, hash_size=4, filter_size=10))
+
+        assert_that(str(cm.exception), equal_to("Filters must have the same size, number of hashes and hash engine. "
+                                                "(1000, 3, 'murmur3') and (1000, 4, 'murmur3') found."))
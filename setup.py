@@ -26,6 +26,12 @@ setuptools.setup(
         'bitarray==0.8.3',
         'numpy==1.15.4',
     ],
+    entry_points={
+        'console_scripts': ['pybloom=pybloom.src.server:main'],
+    },
+    extras_require={
+        'xxh3': ['xxhash'],
+    },
     test_requires=[
         'mock==2.0.0',
         'PyHamcrest',